@@ -14,6 +14,7 @@ from .plot_graph_nx import PlotGraphNx
 from .jmol_MOs import JMolMOs
 from .jmol_vibs import JMolVibs
 from .vmd_plots import VMDPlots
+from .cube_convert import CubeConvert
 from .draw_moments import DrawMoments
 from .babel import Babel
 from .cc_opt import CCOpt
@@ -21,6 +22,7 @@ from .cc_check import CCCheck
 from .extract_molden import ExtractMolden
 from .spectrum import Spectrum
 from .tden_OV import TDenOv
+from .tden_follow import TDenFollow
 from .convert_table import ConvertTable
 from .dgrid_prep import DGridPrep
 from .fcd import FCD
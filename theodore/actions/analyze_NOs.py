@@ -33,6 +33,8 @@ class AnalyzeNOs(Action):
     unrestricted = false :: bool, alias=u
     # Interpret energies as occupations
     rd_ene = false :: bool, alias=e
+    # Number of processes for reading the NO files
+    numproc = :: int, optional, alias=n
     """
 
     _lazy_imports = LazyImporter({
@@ -41,7 +43,7 @@ class AnalyzeNOs(Action):
             '..input_options': 'input_options'
     })
 
-    def run(no_files, ifile, ref, occ_fac, unrestricted, rd_ene):
+    def run(no_files, ifile, ref, occ_fac, unrestricted, rd_ene, numproc):
         theo_header.print_header(__class__._colt_description, cfile=__file__)
 
         # set options
@@ -51,6 +53,8 @@ class AnalyzeNOs(Action):
             ioptions['occ_fac'] = occ_fac
         ioptions['unrestricted'] = unrestricted
         ioptions['rd_ene'] = rd_ene
+        if not numproc is None:
+            ioptions['numproc'] = numproc
 
         # optionally use a manually specified MO file for computing the AO overlap matrix
         if ref is None:
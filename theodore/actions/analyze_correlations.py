@@ -62,26 +62,12 @@ class AnCorr_options(input_options.write_options):
         """
         Read the OmFrag.txt file written by analyze_tden.py
         """
-        Ofile = open(fname, 'r')
-        data = Ofile.readlines()
-        Ofile.close()
-
-        self.numF = int(data[0].split()[0])
-
-        matrix = []
-        for line in data:
-
-            words = line.split()
-            if len(words)<=1:
-                continue
-            m = [ float(x) for x in words[2:] ]
-            matrix.append(m)
-            self.Omega[words[0]]=float(words[1])
-            self.maxOm = max(self.maxOm, max(m))
-
-        D=numpy.array(matrix)
-        a,b=D.shape
-        D=D.reshape(a,self.numF,self.numF)
+        names, Oms, D = lib_file.read_OmFrag(fname)
+        self.numF = D.shape[1]
+
+        self.Omega.update(zip(names, Oms.tolist()))
+        if len(D) > 0:
+            self.maxOm = max(self.maxOm, D.max())
         self.OmFrag=D
         print(('Number of fragments: %i' % self.numF))
         print(('Descriptor data (dimensions: %i obs x %i frags x %i frags):' % D.shape))
@@ -215,130 +201,77 @@ class AnCorr_options(input_options.write_options):
     def compute(self):
 
         # ------------------- hole
-        self.output_h={}
-
         # compute hole correlation matrix
-        self.output_h['COR'] = self.calc_corr_matrix(self.OmFrag,userows=False,usecols=True)
-
-        # compute distance matrix
-        DIS = self.calc_dist_matrix(self.output_h['COR'])
-        self.output_h['DIS'] = numpy.copy(DIS)
-
-        # perform clustering
-        Z=squareform( DIS, checks=False )
-        Y=sch.linkage( Z, method=self.opt_dict['link_scheme'] )
-        cc,C=sch.cophenet(Y,Z)
-        I=sch.inconsistent(Y)
-        self.output_h['dendro'] = Y
-        self.output_h['cophco'] = cc
-        self.output_h['incons'] = I
-
-        # analyze clusters
-        self.output_h['cluster'], self.output_h['maxd']=self.find_clustering(Y)
-
-
+        COR_h = self.calc_corr_matrix(self.OmFrag,userows=False,usecols=True)
+        self.output_h = self.cluster_analysis(COR_h)
 
         # ------------------- electron
-        self.output_e={}
-
         # compute electron correlation matrix
-        self.output_e['COR'] = self.calc_corr_matrix(self.OmFrag,userows=True,usecols=False)
-
-        # compute distance matrix
-        DIS = self.calc_dist_matrix(self.output_e['COR'])
-        self.output_e['DIS'] = numpy.copy(DIS)
-
-        # perform clustering
-        Z=squareform( DIS, checks=False )
-        Y=sch.linkage( Z, method=self.opt_dict['link_scheme'] )
-        cc,C=sch.cophenet(Y,Z)
-        I=sch.inconsistent(Y)
-        self.output_e['dendro'] = Y
-        self.output_e['cophco'] = cc
-        self.output_e['incons'] = I
-
-        # analyze clusters
-        self.output_e['cluster'], self.output_e['maxd']=self.find_clustering(Y)
-
-
+        COR_e = self.calc_corr_matrix(self.OmFrag,userows=True,usecols=False)
+        self.output_e = self.cluster_analysis(COR_e)
 
         # ------------------- mixed
-        self.output_m={}
-
         # compute mixed correlation matrix (maximum of hole and electron)
-        self.output_m['COR'] = numpy.where(self.output_e['COR']>=self.output_h['COR'],
-                                           self.output_e['COR'],
-                                           self.output_h['COR'])
+        COR_m = numpy.maximum(COR_e, COR_h)
+        self.output_m = self.cluster_analysis(COR_m)
+
+    # =======================================================================
+    def cluster_analysis(self,COR):
+        """
+        Compute the distance matrix and perform the clustering for one
+        correlation matrix. Returns the output dictionary.
+        """
+        output={}
+        output['COR'] = COR
 
         # compute distance matrix
-        DIS = self.calc_dist_matrix(self.output_m['COR'])
-        self.output_m['DIS'] = numpy.copy(DIS)
+        DIS = self.calc_dist_matrix(COR)
+        output['DIS'] = DIS
 
         # perform clustering
         Z=squareform( DIS, checks=False )
         Y=sch.linkage( Z, method=self.opt_dict['link_scheme'] )
-        cc,C=sch.cophenet(Y,Z)
-        I=sch.inconsistent(Y)
-        self.output_m['dendro'] = Y
-        self.output_m['cophco'] = cc
-        self.output_m['incons'] = I
+        output['dendro'] = Y
+        output['cophco'] = sch.cophenet(Y,Z)[0]
+        output['incons'] = sch.inconsistent(Y)
 
         # analyze clusters
-        self.output_m['cluster'], self.output_m['maxd']=self.find_clustering(Y)
-
-        #print self.output
+        output['cluster'], output['maxd']=self.find_clustering(Y)
 
+        return output
 
     # =======================================================================
-    def calc_corr_matrix(self,D,userows=True,usecols=False):
+    def calc_corr_matrix(self,D,userows=True,usecols=False,maxel=2**22):
+        """
+        Compute the correlation matrix between fragments.
+        userows: covariance of the columns of the Om matrices (electron)
+        usecols: covariance of the rows of the Om matrices (hole)
+        The covariances are computed as contractions of the centred data,
+          processed in chunks of at most maxel elements.
+        """
         a,b,c=D.shape
         if not b==c:
             print(('Data is not shaped correctly: %i,%i,%i' % (a,b,c)))
             exit(1)
-        V1=numpy.zeros(b)
-        V2=numpy.zeros(b)
-        # compute row covariance
+        D=numpy.asarray(D,dtype=float)
+        mean=numpy.mean(D,axis=0)
+        # compute row and column covariance and add both
         COV=numpy.zeros( (b,b) )
-        if userows:
-            for M in range(b):
-                for N in range(b):
-                    for I in range(a):
-                        COV[M,N]+=numpy.dot( D[I,:,M],D[I,:,N] )
-                    COV[M,N]/=a
-                    V1=0.
-                    V2=0.
-                    for I in range(a):
-                        V1+=D[I,:,M]
-                        V2+=D[I,:,N]
-                    V1/=a
-                    V2/=a
-                    COV[M,N]-=numpy.dot(V1,V2)
-        # compute column covariance
-        COV2=numpy.zeros( (b,b) )
-        if usecols:
-            for M in range(b):
-                for N in range(b):
-                    for I in range(a):
-                        COV2[M,N]+=numpy.dot( D[I,M,:],D[I,N,:] )
-                    COV2[M,N]/=a
-                    V1=0.
-                    V2=0.
-                    for I in range(a):
-                        V1+=D[I,M,:]
-                        V2+=D[I,N,:]
-                    V1/=a
-                    V2/=a
-                    COV2[M,N]-=numpy.dot(V1,V2)
-        # average both
-        COV+=COV2
+        nchunk=max(1, maxel // (b*b))
+        for ist in range(0, a, nchunk):
+            Dc=D[ist:ist+nchunk]-mean
+            if userows:
+                COV+=numpy.tensordot(Dc, Dc, axes=([0,1],[0,1]))
+            if usecols:
+                COV+=numpy.tensordot(Dc, Dc, axes=([0,2],[0,2]))
+        if a > 0:
+            COV/=a
         # compute correlation matrix
-        COR=numpy.zeros( (b,b) )
-        for M in range(b):
-            for N in range(b):
-                COR[M,N]=COV[M,N]/numpy.sqrt(COV[M,M])/numpy.sqrt(COV[N,N])
+        sig=numpy.sqrt(numpy.diag(COV))
+        with numpy.errstate(divide='ignore', invalid='ignore'):
+            COR=COV/numpy.outer(sig,sig)
         # sanitize data
-        COR=numpy.where(COR < -1.,-1.,COR)
-        COR=numpy.where(COR > +1.,+1.,COR)
+        COR=numpy.clip(COR,-1.,+1.)
         COR=numpy.nan_to_num(COR)
         numpy.fill_diagonal(COR,1.0)
         # return
@@ -63,11 +63,14 @@ class AnalyzeTden(Action):
         if ioptions['comp_rho0n']: 
             tdena.compute_rho_0_n()
 
-        if 'RMSeh' in ioptions.get('prop_list') or 'MAeh' in ioptions.get('prop_list') or 'Eb' in ioptions.get('prop_list'):
+        if any(prop in ioptions.get('prop_list') for prop in lib_exciton.exciton_props):
             exca = lib_exciton.exciton_analysis()
-            exca.get_distance_matrix(tdena.struc)
+            exca.get_distance_matrix(tdena.struc, ioptions['Eb_diag'])
             tdena.analyze_excitons(exca)
 
+        if ioptions['exc_grid']:
+            tdena.analyze_excitons_grid(lib_exciton.exciton_analysis())
+
         if 'Phe' in ioptions['prop_list']:
             tdena.compute_all_Phe()
 
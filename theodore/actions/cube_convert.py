@@ -0,0 +1,36 @@
+"""
+Conversion between text and compressed binary cube files.
+"""
+from __future__ import print_function, division
+from .actions import Action
+from colt.lazyimport import LazyImportCreator, LazyImporter
+
+
+with LazyImportCreator() as importer:
+    theo_header = importer.lazy_import_as('..theo_header', 'theo_header')
+    lib_util = importer.lazy_import_as('..lib_util', 'lib_util')
+
+
+class CubeConvert(Action):
+
+    name = 'cube_convert'
+
+    _colt_description = 'Conversion between text (.cb) and binary (.cbz) cube files'
+
+    _user_input = """
+    # List of cube files, .cbz files are converted to .cb and all others to .cbz
+    cubefiles = :: list(existing_file)
+    # Data type of the values in binary cube files
+    dtype = float32 :: str :: float32, float64
+    """
+
+    _lazy_imports = LazyImporter({
+            '..theo_header': 'theo_header',
+            '..lib_util': 'lib_util',
+    })
+
+    def run(cubefiles, dtype):
+        theo_header.print_header(__class__._colt_description)
+
+        for cubefile in cubefiles:
+            lib_util.convert_cube(cubefile, dtype=dtype, lvprt=1)
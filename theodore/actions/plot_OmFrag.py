@@ -37,31 +37,13 @@ class OmFrag_options(input_options.write_options):
         """
         Read the OmFrag.txt file written by analyze_tden.py
         """
-        Ofile = open(fname, 'r')
-        line = next(Ofile)
+        names, Oms, OmFrags = lib_file.read_OmFrag(fname)
 
-        numF = int(line)
+        for name, Om, OmFrag in zip(names, Oms, OmFrags):
+            self.state_list.append({'name':name, 'Om':Om, 'OmFrag':OmFrag.T})
 
-        while True:
-            try:
-                line = next(Ofile)
-            except StopIteration:
-                break
-
-            words = line.split()
-
-            self.state_list.append({})
-            state = self.state_list[-1]
-            state['name'] = words[0]
-            state['Om'] = words[1]
-            state['OmFrag'] = numpy.zeros([numF, numF])
-
-            for iel, el in enumerate(words[2:]):
-                iF = iel %  numF
-                jF = iel // numF
-                state['OmFrag'][iF, jF] = el
-
-            self.maxOm = max(self.maxOm, state['OmFrag'].max())
+        if len(OmFrags) > 0:
+            self.maxOm = max(self.maxOm, OmFrags.max())
 
     def OmFrag_input(self, use_new=False):
 
@@ -27,23 +27,11 @@ class Om_bar_options(input_options.write_options):
         """
         Read the OmFrag.txt file written by analyze_tden.py
         """
-        self.state_list = []
-        Ofile = open(fname, 'r')
-        line = next(Ofile)
+        names, Oms, OmFrags = lib_file.read_OmFrag(fname)
+        self.numF = OmFrags.shape[1]
 
-        self.numF = int(line)
-
-        while True:
-            try:
-                line = next(Ofile)
-            except StopIteration:
-                break
-
-            words = line.split()
-
-            self.state_list.append({'name':words[0],
-                'Om':float(words[1]),
-                'OmFrag':list(map(float, words[2:]))})
+        self.state_list = [{'name':name, 'Om':Om, 'OmFrag':OmFrag.ravel()}
+                           for name, Om, OmFrag in zip(names, Oms, OmFrags)]
         self.numSt = len(self.state_list)
 
     def Om_bar_input(self):
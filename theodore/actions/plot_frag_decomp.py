@@ -13,6 +13,7 @@ with LazyImportCreator() as importer:
     theo_header = importer.lazy_import_as('..theo_header', 'theo_header')
     input_options = importer.lazy_import_as('..input_options', 'input_options')
     error_handler = importer.lazy_import_as('..error_handler', 'error_handler')
+    lib_file = importer.lazy_import_as('..lib_file', 'lib_file')
     matplotlib = importer.lazy_import('matplotlib')
     pylab = importer.lazy_import('pylab')
 
@@ -34,29 +35,11 @@ class decomp_options(input_options.write_options):
         """
         Read the OmFrag.txt file written by analyze_tden.py
         """
-        Ofile = open(fname, 'r')
-        line = next(Ofile)
+        names, Oms, OmFrags = lib_file.read_OmFrag(fname)
+        self.numF = OmFrags.shape[1]
 
-        self.numF = int(line)
-
-        while True:
-            try:
-                line = next(Ofile)
-            except StopIteration:
-                break
-
-            words = line.split()
-
-            self.state_list.append({})
-            state = self.state_list[-1]
-            state['name'] = words[0]
-            state['Om'] = words[1]
-            state['OmFrag'] = numpy.zeros([self.numF, self.numF], float)
-
-            for iel, el in enumerate(words[2:]):
-                iF = iel %  self.numF
-                jF = iel // self.numF
-                state['OmFrag'][iF, jF] = el # max(float(el), 0.)
+        for name, Om, OmFrag in zip(names, Oms, OmFrags):
+            self.state_list.append({'name':name, 'Om':Om, 'OmFrag':OmFrag.T})
 
     def decomp_input(self):
 
@@ -115,6 +98,7 @@ class PlotFragDecomp(Action):
             '..theo_header': 'theo_header',
             '..input_options': 'input_options',
             '..error_handler': 'error_handler',
+            '..lib_file': 'lib_file',
             'matplotlib': 'matplotlib',
             'pylab': 'pylab',
     })
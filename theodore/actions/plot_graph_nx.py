@@ -4,6 +4,8 @@ Script for creating graphs from multiple directories, e.g. potential curves.
 """
 
 from __future__ import print_function, division
+import os
+import numpy
 from .actions import Action
 from colt.lazyimport import LazyImportCreator, LazyImporter
 
@@ -13,14 +15,22 @@ with LazyImportCreator() as importer:
     input_options = importer.lazy_import_as('..input_options', 'input_options')
     lib_plot = importer.lazy_import_as('..lib_plot', 'lib_plot')
     lib_file = importer.lazy_import_as('..lib_file', 'lib_file')
+    error_handler = importer.lazy_import_as('..error_handler', 'error_handler')
 
 
 class write_plot_options_nx(lib_plot.write_plot_options):
-    def plot_input(self):
+    def plot_input(self, traj_dirs=None, props=None, numproc=1):
+        """
+        Read input from command line.
+        traj_dirs, props, and numproc are set directly rather than read interactively.
+        """
         self['ana_dirs']=[]
         self['ana_file']='nx.log'
         self['state_labels']=None
         self['dognu'] = False
+        self['traj_dirs'] = [] if traj_dirs is None else traj_dirs
+        self['props'] = props
+        self['numproc'] = numproc
 
         self.read_int('Number of states to plot', 'nstate', 10)
         self.read_float('Minimum time', 'tmin', 0.)
@@ -34,69 +44,106 @@ class write_plot_options_nx(lib_plot.write_plot_options):
         self.read_yn('Print txt files with the information', 'dotxt', True)
 
     def read_data(self):
-        self.data = []
+        """
+        Read the data from the nx.log files of all trajectory directories.
+        Only the requested properties are extracted into the arrays
+          self.times (nstep) and self.vals (nstep, nstate+1, nprop),
+          where the last state is the active state.
+        For several trajectories, the values are averaged over all trajectories
+          running at a given time and the populations of the states are added as pop.
+        """
         self.main_header = ''
         self.data_avail = []
-        self.times = []
-        self.act = []
-
-        f = open(self['ana_file'])
-        while True:
-            try:
-                line = next(f)
-            except StopIteration:
-                break
-
-            if 'state       dE(eV)' in line:
-                ddict = {}
-                state_labels = []
-
-                header = line.split()
-
-                line = next(f) # ------
-                line = next(f)
-
-                for istate in range(self['nstate']):
-                    if 'Finished' in line: break
-
-                    words = line.split()
-                    state_label = words[0]
-                    ddict[state_label] = {}
-                    pdict = ddict[state_label]
-                    state_labels.append(state_label)
-
-                    for i, prop in enumerate(header[1:]):
-                        try:
-                            pdict[prop] = float(words[i+1])
-                        except ValueError:
-                            pass
-                    pdict['ddE'] = pdict['dE(eV)'] - ddict[state_labels[0]]['dE(eV)']
-                    line = next(f)
-
-            if 'FINISHING STEP' in line:
-                words = line.split()
-                time = float(words[4])
-
-                if self['tmax'] <= time:
-                    break
-                elif self['tmin'] <= time:
-                    self['ana_dirs'].append(time)
-                    self.times.append(time)
-                    act = int(words[-1]) - 2
-                    ddict['act'] = ddict[state_labels[act]]
-                    self.data.append(ddict)
-
-        f.close()
-
-        self.main_header = header + ['ddE']
-        self['state_labels'] = state_labels + ['act']
-        self['leg_labels'] = state_labels + ['act']
 
+        tdirs = self['traj_dirs'] or ['.']
+        args = [(os.path.join(tdir, self['ana_file']), self['nstate'], self['tmin'], self['tmax'],
+                 self.get('props', strict=False)) for tdir in tdirs]
+
+        if self['numproc'] > 1 and len(args) > 1:
+            print("Reading %i trajectories using %i processes ..."%(len(args), self['numproc']))
+            from multiprocessing import Pool
+            with Pool(self['numproc']) as pool:
+                self.aggregate(pool.imap(_read_traj, args, chunksize=1))
+        else:
+            self.aggregate(_read_traj(arg) for arg in args)
+
+        self.sind = {state: i for i, state in enumerate(self['state_labels'])}
+        self.pind = {prop: i for i, prop in enumerate(self.main_header[1:])}
+
+    def aggregate(self, trajs):
+        """
+        Sum up the time series of the individual trajectories.
+        """
+        nstate = self['nstate']
+        ntraj = 0
+        labels = []
+        times = numpy.zeros(0)
+
+        for traj in trajs:
+            n, ns, nprop = traj['vals'].shape
+            if ntraj == 0:
+                props = traj['props']
+                vsum = numpy.zeros((0, nstate + 1, nprop))
+                vcnt = numpy.zeros((0, nstate + 1, nprop))
+                pop  = numpy.zeros((0, nstate))
+                nrun = numpy.zeros(0)
+            ntraj += 1
+            if len(traj['labels']) > len(labels):
+                labels = traj['labels']
+
+            # extend the time axis
+            nt = len(times)
+            if not numpy.allclose(times[:n], traj['times'][:nt]):
+                raise error_handler.MsgError("Time steps differ between the trajectories")
+            if n > nt:
+                times = numpy.concatenate((times, traj['times'][nt:]))
+                vsum = numpy.concatenate((vsum, numpy.zeros((n - nt,) + vsum.shape[1:])))
+                vcnt = numpy.concatenate((vcnt, numpy.zeros((n - nt,) + vcnt.shape[1:])))
+                pop  = numpy.concatenate((pop,  numpy.zeros((n - nt, nstate))))
+                nrun = numpy.concatenate((nrun, numpy.zeros(n - nt)))
+
+            # values of the states and of the active state
+            act = traj['act']
+            valid = (act >= 0) & (act < ns)
+            vals = numpy.full((n, nstate + 1, nprop), numpy.nan)
+            vals[:, :ns] = traj['vals']
+            vals[valid, nstate] = traj['vals'][valid, act[valid]]
+
+            mask = ~numpy.isnan(vals)
+            vsum[:n] += numpy.where(mask, vals, 0.)
+            vcnt[:n] += mask
+            numpy.add.at(pop, (numpy.nonzero(valid)[0], act[valid]), 1.)
+            nrun[:n] += 1.
+
+        if ntraj == 0:
+            raise error_handler.MsgError("No trajectories found")
+
+        nlab = len(labels)
+        ind = list(range(nlab)) + [nstate]
+        with numpy.errstate(divide='ignore', invalid='ignore'):
+            self.vals = (vsum / vcnt)[:, ind]
+        if ntraj > 1:
+            print("Number of trajectories: %i"%ntraj)
+            ppop = numpy.full((len(times), nlab + 1, 1), numpy.nan)
+            ppop[:, :nlab, 0] = pop[:, :nlab] / nrun[:, None]
+            self.vals = numpy.concatenate((self.vals, ppop), axis=2)
+            props = props + ['pop']
+
+        self.times = times.tolist()
+        self['ana_dirs'] = self.times
+        self.main_header = ['state'] + props
+        self['state_labels'] = labels + ['act']
+        self['leg_labels'] = labels + ['act']
+
+    def ret_val(self, idir, state, key):
+        val = self.vals[idir, self.sind[state], self.pind[key]]
+        if numpy.isnan(val):
+            raise KeyError(key)
+        return val
 
     def plot(self):
         """
         Create the plots.
-        For this purpose, self.data has to be rearranged.
         """
         try:
             import matplotlib
@@ -117,8 +164,6 @@ class write_plot_options_nx(lib_plot.write_plot_options):
         lfile.pre('Property graphs', graphicx=True)
         ltable = lib_file.latextable(ncol=2)
 
-        #set1 = self.data[0][self['state_labels'][0]] # not used anywhere??
-
         matplotlib.rc('font', size=self['fsize'])
 
         for key in self.main_header[1:]:
@@ -133,13 +178,9 @@ class write_plot_options_nx(lib_plot.write_plot_options):
                 else:
                     symb = '-'
 
-                ylist = []
-                for iana_dir in range(len(self['ana_dirs'])):
-                    try:
-                        ylist.append(self.data[iana_dir][state][key])
-                    except KeyError:
-                        print(" ... not able to plot %s for %s."%(key, state))
-                        break
+                ylist = self.vals[:, self.sind[state], self.pind[key]]
+                if numpy.any(numpy.isnan(ylist)):
+                    print(" ... not able to plot %s for %s."%(key, state))
                 else:
                     pylab.plot(self.times, ylist, symb)
 
@@ -163,27 +204,41 @@ class write_plot_options_nx(lib_plot.write_plot_options):
         lfile.post(lvprt=1)
 
 
+def _read_traj(args):
+    return lib_file.read_nx_log(*args)
+
+
 class PlotGraphNx(Action):
 
     name = 'plot_graph_nx'
 
     _colt_description = 'Graph plotting (Newton-X)'
 
+    _user_input = """
+    # Trajectory directories to analyze (default: current directory)
+    traj_dirs = :: list(existing_folder), optional, alias=d
+    # Properties to analyze (default: all)
+    props = :: list(str), optional, alias=p
+    # Number of processes for reading the trajectories
+    numproc = 1 :: int, alias=n
+    """
+
     _lazy_imports = LazyImporter({
             '..theo_header': 'theo_header',
             '..input_options': 'input_options',
             '..lib_plot': 'lib_plot',
             '..lib_file': 'lib_file',
+            '..error_handler': 'error_handler',
     })
 
 
-    def run():
+    def run(traj_dirs, props, numproc):
         theo_header.print_header(title=__class__._colt_description)
         infilen = 'graph.in'
 
         popt = write_plot_options_nx(infilen)
 
-        popt.plot_input()
+        popt.plot_input(traj_dirs, props, numproc)
         popt.read_data()
 
         if popt['doplots']: popt.plot()
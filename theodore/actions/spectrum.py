@@ -5,7 +5,7 @@ Create a convoluted spectrum from the oscillator strengths.
 
 from __future__ import print_function, division
 import sys
-import math, numpy
+import math, numpy, operator
 from .actions import Action
 from colt.lazyimport import LazyImportCreator, LazyImporter
 
@@ -51,33 +51,41 @@ class spec_options(input_options.write_options):
 
         print()
 
+    def ret_restrictions(self):
+        """
+        Return the restrictions as list of (property, comparison function, value).
+        """
+        restrs = []
+        if not self['restr']:
+            return restrs
+
+        for prop, opstr, valstr in self['rlist']:
+            if not opstr in comp_ops:
+                raise error_handler.MsgError('Unknown comparison in restriction: %s'%opstr)
+            restrs.append((prop, comp_ops[opstr], float(valstr)))
+        return restrs
+
     def make_spec(self, lvprt=2):
+        """
+        Read the summary files one after the other and add their states to the spectrum.
+        """
+        restrs = self.ret_restrictions()
         for filen in self['ana_files']:
             sfile = lib_file.summ_file(filen)
-            header = sfile.ret_header()
-            ddict  = sfile.ret_ddict()
-            state_labels = sfile.ret_state_labels()
-
-            n = ntake = 0
-
-            for state in state_labels:
-                n += 1
-                try:
-                    f = ddict[state]['f']
-                except KeyError:
-                    f = 0.
-
-                if self['restr']:
-                    for restr in self['rlist']:
-                        evalstr = ("ddict[state]['%s'] %s %s")%restr
-                        if not eval(evalstr):
-                            break
-                    else:
-                        self.spec.add(f, ddict[state]['dE(eV)'])
-                        ntake += 1
-                else:
-                    self.spec.add(f, ddict[state]['dE(eV)'])
-                    ntake += 1
+
+            ens = sfile.ret_column('dE(eV)')
+            try:
+                fs = numpy.nan_to_num(sfile.ret_column('f'))
+            except error_handler.MsgError:
+                fs = numpy.zeros(len(ens))
+
+            take = numpy.ones(len(ens), bool)
+            for prop, comp, val in restrs:
+                take &= comp(sfile.ret_column(prop), val)
+
+            self.spec.add_sticks(fs[take], ens[take])
+            n = len(ens)
+            ntake = numpy.sum(take)
 
             if lvprt >= 2:
                 print("Considering %3i out of %3i states from %s"%(ntake, n, filen))
@@ -95,13 +103,26 @@ class spec_options(input_options.write_options):
             self.spec.plot(xunit='nm', pname='spectrum_nm.png', weight=self['weight'])
             self.spec.plot(xunit='rcm', pname='spectrum_rcm.png', weight=self['weight'])
 
+# comparisons allowed in restrictions
+comp_ops = {'>': operator.gt, '>=': operator.ge, '<': operator.lt, '<=': operator.le,
+            '==': operator.eq, '!=': operator.ne}
+
 # Code adapted from SHARC
+#   ev works on numpy arrays, all arguments are broadcast
+#   ret_cutoff: distance beyond which the line shape is below tol
+#   ret_bin_err: error of linear interpolation between grid points of spacing h
 class gauss:
     def __init__(self,fwhm):
         self.c=-4.*math.log(2.)/fwhm**2
 
     def ev(self,A,x0,x):
-        return A*math.exp( self.c*(x-x0)**2)
+        return A*numpy.exp( self.c*(x-x0)**2)
+
+    def ret_cutoff(self, tol):
+        return math.sqrt(math.log(tol)/self.c)
+
+    def ret_bin_err(self, h):
+        return -self.c * h**2 / 4.
 
 class lorentz:
     def __init__(self,fwhm):
@@ -110,8 +131,14 @@ class lorentz:
     def ev(self,A,x0,x):
         return A/( (x-x0)**2/self.c+1)
 
+    def ret_cutoff(self, tol):
+        return math.sqrt(self.c * (1./tol - 1.))
+
+    def ret_bin_err(self, h):
+        return h**2 / (4. * self.c)
+
 class spectrum:
-    def __init__(self,npts,emin,emax,fwhm,lineshape,ana_files):
+    def __init__(self,npts,emin,emax,fwhm,lineshape,ana_files,tol=1.e-6):
       self.npts=npts
       (self.emin, self.emax) = (emin, emax)
       if lineshape==1:
@@ -119,23 +146,112 @@ class spectrum:
       elif lineshape==2:
           self.f=lorentz(fwhm)
 
-      self.en = [emin + float(i)/self.npts*(emax-emin) for i in range(self.npts+1)]       # the energy grid needs to be calculated only once
+      self.en = emin + numpy.arange(self.npts+1) / self.npts * (emax-emin)       # the energy grid needs to be calculated only once
       lamev = units.energy['nm'] * units.energy['eV']
-      self.lam = [lamev / en for en in self.en]
-      self.spec=numpy.array([ 0. for i in range(self.npts+1) ])
-      self.dos=numpy.array([ 0. for i in range(self.npts+1) ])
+      self.lam = lamev / self.en
+      self.spec=numpy.zeros(self.npts+1)
+      self.dos=numpy.zeros(self.npts+1)
 
       self.sticks=[] # list of pairs (A,x0), unit for x0: eV
+      self.maxel = 2**22 # maximal number of line shape values evaluated at once
 
-    def add(self,A,x0):
-        for i in range(self.npts+1):
-            self.dos[i] +=self.f.ev(.1,x0,self.en[i])
+      # Every line shape is only evaluated within +/- nwin grid points,
+      #   beyond which it is smaller than tol times its maximum
+      self.tol = tol
+      self.h = (emax - emin) / npts
+      self.nwin = int(math.ceil(self.f.ret_cutoff(tol) / self.h)) + 1
 
-        if A!=0.:
-            self.sticks += [(A,x0)]
-
-            for i in range(self.npts+1):
-                self.spec[i]+=self.f.ev(A,x0,self.en[i])
+    def add(self,A,x0):
+        self.add_sticks([A], [x0])
+
+    def add_sticks(self, As, x0s):
+        """
+        Add several sticks with amplitudes As at energies x0s.
+        The sticks are sorted and only those within the cutoff window around the
+          energy range are used. Depending on the estimated cost, the line shapes are
+          - binned onto a grid and convoluted by FFT (for many sticks),
+          - evaluated on the whole grid (window larger than the grid),
+          - or evaluated within the window around every stick.
+        """
+        As = numpy.asarray(As, float)
+        x0s = numpy.asarray(x0s, float)
+
+        nonzero = As != 0.
+        self.sticks += list(zip(As[nonzero].tolist(), x0s[nonzero].tolist()))
+
+        order = numpy.argsort(x0s, kind='stable')
+        x0s = x0s[order]
+        As = As[order]
+        ist, ien = numpy.searchsorted(x0s, [self.emin - self.nwin * self.h, self.emax + self.nwin * self.h])
+        x0s = x0s[ist:ien]
+        As = As[ist:ien]
+
+        nsub = self.ret_nsub()
+        nfft = (self.npts + 4 * self.nwin) * nsub
+        cost_bin = 2 * nfft * math.log(nfft, 2) + 10 * len(x0s)
+        cost_win = len(x0s) * min(2 * self.nwin + 1, len(self.en))
+
+        if cost_bin < cost_win:
+            self.add_binned(As, x0s, nsub)
+        elif 2 * self.nwin + 1 >= len(self.en):
+            self.add_full(As, x0s)
+        else:
+            self.add_windowed(As, x0s)
+
+    def ret_nsub(self):
+        """
+        Number of bins per grid spacing needed to keep the error of linear binning below tol.
+        """
+        return max(1, int(math.ceil(math.sqrt(self.f.ret_bin_err(self.h) / self.tol))))
+
+    def add_full(self, As, x0s):
+        """
+        Evaluate the line shapes as (sticks x grid) arrays, in chunks of sticks
+          to keep the memory bounded by maxel.
+        """
+        nchunk = max(1, self.maxel // len(self.en))
+        for ist in range(0, len(x0s), nchunk):
+            ien = ist + nchunk
+            shapes = self.f.ev(1., x0s[ist:ien, None], self.en[None, :])
+            self.dos += .1 * numpy.sum(shapes, 0)
+            self.spec += numpy.dot(As[ist:ien], shapes)
+
+    def add_windowed(self, As, x0s):
+        """
+        Evaluate the line shapes within +/- nwin points around every stick
+          and scatter-add them to the grid.
+        """
+        offs = numpy.arange(-self.nwin, self.nwin + 1)
+        nchunk = max(1, self.maxel // len(offs))
+        for ist in range(0, len(x0s), nchunk):
+            ien = ist + nchunk
+            inds = numpy.rint((x0s[ist:ien, None] - self.emin) / self.h).astype(int) + offs
+            shapes = self.f.ev(1., x0s[ist:ien, None], self.emin + inds * self.h)
+            valid = (inds >= 0) & (inds <= self.npts)
+            inds = inds[valid]
+            self.dos += .1 * numpy.bincount(inds, shapes[valid], len(self.en))
+            self.spec += numpy.bincount(inds, (As[ist:ien, None] * shapes)[valid], len(self.en))
+
+    def add_binned(self, As, x0s, nsub=1):
+        """
+        Distribute the sticks onto the two nearest points of a grid with spacing h/nsub,
+          extended by the window at both sides (linear binning), and convolute
+          with the line shape by FFT.
+        """
+        hb = self.h / nsub
+        nw = self.nwin * nsub
+        nbin = self.npts * nsub + 1 + 2 * nw
+        pos = (x0s - self.emin) / hb + nw
+        ibin = numpy.floor(pos).astype(int)
+        wt = pos - ibin
+
+        nfft = 2**int(math.ceil(math.log(nbin + 2 * nw, 2)))
+        shape_ft = numpy.fft.rfft(self.f.ev(1., 0., hb * numpy.arange(-nw, nw + 1)), nfft)
+        for weights, ret in [(numpy.full(len(x0s), .1), self.dos), (As, self.spec)]:
+            hist = numpy.bincount(ibin, weights * (1. - wt), nbin + 1)
+            hist += numpy.bincount(ibin + 1, weights * wt, nbin + 1)
+            conv = numpy.fft.irfft(numpy.fft.rfft(hist[:nbin], nfft) * shape_ft, nfft)
+            ret += conv[2 * nw:nbin:nsub]
 
     def info(self):
         print("\nSpectrum costructed from %i states with non-vanishing osc. strength"%len(self.sticks))
@@ -161,10 +277,9 @@ class spectrum:
         wf.write('   eV     spectrum    DOS     nm\n')
 
         wt = lib_file.asciitable(ncol=4)
-        for i, en in enumerate(self.en):
-            wt.add_row([en, self.spec[i], self.dos[i], self.lam[i]])
+        wt.add_rows(numpy.column_stack((self.en, self.spec, self.dos, self.lam)))
 
-        wf.write(wt.ret_table())
+        wt.write_table(wf.f)
         wf.post(lvprt=1)
 
     def plot(self, xunit=1, pname='spectrum.png', lvprt=1, weight=1):
@@ -214,8 +329,11 @@ class Spectrum(Action):
     _colt_description = 'Convoluted spectrum from analyze_tden output'
     
     _user_input = """
-    # Files produced by analyze_tden.py
+    # Files produced by analyze_tden.py (text or binary .npy)
     tden_summs = :: list(existing_file)
+    # Accuracy of the line shapes relative to their maximum
+    #   (determines the cutoff window and the binning density)
+    tol = 1.e-6 :: float, alias=t
     """
 
     _lazy_imports = LazyImporter({
@@ -228,12 +346,13 @@ class Spectrum(Action):
             'pylab': 'pylab',
     })
 
-    def run(tden_summs):
+    def run(tden_summs, tol):
         matplotlib.use('Agg')
         theo_header.print_header(title=__class__._colt_description)
 
         sopt = spec_options('spectrum.in')
         sopt['ana_files'] = tden_summs
+        sopt['tol'] = tol
         sopt.spec_input()
 
         sopt.make_spec()
@@ -30,6 +30,8 @@ class TDenOv(Action):
     ifile = tden_OV.in :: existing_file, alias=f
     # name of input file for the second computation
     ifile2 = :: existing_file, optional, alias=f2
+    # write the overlap matrix and state names to this binary file (.npz)
+    ovfile = :: str, optional, alias=o
     """
 
     _lazy_imports = LazyImporter({
@@ -39,20 +41,17 @@ class TDenOv(Action):
             '..input_options': 'input_options',
     })
 
-    def run(dir1, dir2, ao_ov, ifile, ifile2):
-        ifile = 'tden_OV.in'
-        ifile2 = ''
-        
+    def run(dir1, dir2, ao_ov, ifile, ifile2, ovfile):
         ioptions = input_options.tden_ana_options(ifile)
         theo_header.print_header(title=__class__._colt_description, ioptions=ioptions)
-        
+
         if ifile2 is None:
             ioptions2 = ioptions
         else:
             ioptions2 = input_options.tden_ana_options(ifile2)
-        
+
         sdir = os.getcwd()
-        
+
         # Read info for the first job
         os.chdir(dir1)
         tdena1 = lib_tden.tden_ana(ioptions)
@@ -60,7 +59,7 @@ class TDenOv(Action):
             tdena1.read_mos()
         tdena1.read_dens()
         os.chdir(sdir)
-        
+
         # Read info for the second job
         os.chdir(dir2)
         tdena2 = lib_tden.tden_ana(ioptions2)
@@ -68,47 +67,70 @@ class TDenOv(Action):
             tdena2.read_mos()
         tdena2.read_dens()
         os.chdir(sdir)
-        
-        if AO_OV == None:
+
+        if ao_ov is None:
             print("Constructing AO-overlap matrix from MO-coefficients")
             tdena1.mos.compute_inverse()
             SMO = numpy.dot(tdena1.mos.inv_mo_mat, tdena2.mos.mo_mat)
             if ioptions['lvprt'] >= 2:
                 SAO = numpy.dot(tdena1.mos.inv_mo_mat.T, tdena1.mos.inv_mo_mat)
         else:
-            SAO  = numpy.array([[float(s) for s in line.split()] for line in open(AO_OV, 'r').readlines()[1:]])
-        
+            SAO  = numpy.array([[float(s) for s in line.split()] for line in open(ao_ov, 'r').readlines()[1:]])
+
             CS  = numpy.dot(tdena1.mos.mo_mat.T, SAO)
             SMO = numpy.dot(CS, tdena2.mos.mo_mat)
-        
+
         if ioptions['lvprt'] >= 2:
             print("AO-overlap matrix:", SAO.shape)
             print(SAO)
             print()
-        
+
             print("MO-overlap matrix:", SMO.shape)
             print(SMO)
             print()
-        
-        print("        ", end=' ')
-        for state2 in tdena2.state_list:
-            print("   |%7s>"%state2['name'], end=' ')
-        print()
-        
-        for state1 in tdena1.state_list:
-            print("<%7s|"%state1['name'], end=' ')
-            tden1 = state1['tden']
-            DS1 = numpy.dot(tden1, SMO)
-            #print DS1.shape
-            mdim = tden1.shape[0]
-            SDS1 = numpy.dot(SMO[:mdim,:mdim], DS1)
-            #print SDS1.shape
-            for state2 in tdena2.state_list:
-                #if (not 'mult' in state1 or not 'mult' in state2) or (state1['mult'] == state2['mult']):
-                    tden2 = state2['tden']
-                    #print tden2.shape
-                    OV = sum((SDS1 * tden2).flatten())
-                    print(" % .8f"%OV, end=' ')
-                #else:
-                    #print " % .1f       "%0.,
-            print()
+
+        names1 = [state['name'] for state in tdena1.state_list]
+        names2 = [state['name'] for state in tdena2.state_list]
+        OV = ret_tden_ov([state['tden'] for state in tdena1.state_list],
+                         [state['tden'] for state in tdena2.state_list], SMO)
+
+        print("         " + "".join("   |%7s> "%name for name in names2))
+        for name1, row in zip(names1, OV):
+            print("<%7s| "%name1 + "".join(" % .8f "%ov for ov in row))
+
+        if ovfile is not None:
+            with open(ovfile, 'wb') as f:
+                numpy.savez(f, names1=numpy.array(names1, dtype=str),
+                            names2=numpy.array(names2, dtype=str), OV=OV)
+            print("Overlap matrix written to %s"%ovfile)
+
+
+def ret_tden_ov(tdens1, tdens2, SMO, maxel=2**24):
+    """
+    Return the overlap matrix <tden1|S|tden2> between two lists of transition density matrices.
+    The overlap is computed as the contraction of the stacked products D1*S and S^T*D2,
+      which are obtained as one matrix multiplication over all states each.
+    The bra states are processed in chunks of at most maxel matrix elements.
+    """
+    D2 = numpy.array(tdens2, dtype=float)
+    nket = len(D2)
+    if nket == 0 or len(tdens1) == 0:
+        return numpy.zeros((len(tdens1), nket))
+
+    mdim = D2.shape[1]
+    # S^T * D2 for all ket states: (nket, mdim, ncol2)
+    SD2 = numpy.matmul(SMO[:mdim,:mdim].T, D2)
+    del D2
+    SD2 = SD2.reshape(nket, -1)
+
+    OV = numpy.zeros((len(tdens1), nket))
+    nchunk = max(1, maxel // SD2.shape[1])
+    for ist in range(0, len(tdens1), nchunk):
+        D1 = numpy.array(tdens1[ist:ist+nchunk], dtype=float)
+        # D1 * S for the bra states: (nchunk, mdim, ncol2)
+        D1S = numpy.dot(D1.reshape(-1, D1.shape[2]), SMO).reshape(len(D1), -1)
+        if D1S.shape[1] != SD2.shape[1]:
+            raise error_handler.MsgError("Inconsistent dimensions of the transition density matrices")
+        OV[ist:ist+len(D1)] = numpy.dot(D1S, SD2.T)
+
+    return OV
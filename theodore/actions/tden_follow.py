@@ -0,0 +1,171 @@
+"""
+Follow excited states along a sequence of geometries (e.g. a trajectory or a scan)
+  using the overlaps between transition density matrices of consecutive steps.
+"""
+
+from __future__ import print_function, division
+from .actions import Action
+from .tden_OV import ret_tden_ov
+import numpy
+import os
+from colt.lazyimport import LazyImportCreator, LazyImporter
+
+
+with LazyImportCreator() as importer:
+    theo_header = importer.lazy_import_as('..theo_header', 'theo_header')
+    lib_tden = importer.lazy_import_as('..lib_tden', 'lib_tden')
+    lib_util = importer.lazy_import_as('..lib_util', 'lib_util')
+    input_options = importer.lazy_import_as('..input_options', 'input_options')
+    error_handler = importer.lazy_import_as('..error_handler', 'error_handler')
+
+
+class TDenFollow(Action):
+
+    name = 'tden_follow'
+
+    _colt_description = 'State following via transition density matrix overlaps'
+
+    _user_input = """
+    # Directories in the order of the trajectory or scan
+    dirs = :: list(existing_folder)
+    # name of the input file
+    ifile = tden_OV.in :: existing_file, alias=f
+    # output file with the reordered state indices
+    outfile = tden_follow.txt :: str, alias=o
+    """
+
+    _lazy_imports = LazyImporter({
+            '..theo_header': 'theo_header',
+            '..lib_tden': 'lib_tden',
+            '..lib_util': 'lib_util',
+            '..error_handler': 'error_handler',
+            '..input_options': 'input_options',
+    })
+
+    def run(dirs, ifile, outfile):
+        ioptions = input_options.tden_ana_options(ifile)
+        theo_header.print_header(title=__class__._colt_description, ioptions=ioptions)
+
+        follow = state_follow(ioptions)
+        follow.run(dirs)
+        follow.write(outfile)
+
+
+class state_follow:
+    """
+    Assign the states of consecutive steps to each other.
+    The normalized overlaps between the 1TDMs of two steps are computed with the
+      MO overlap matrix inv(C1)*C2 and the states are matched by maximizing the sum of
+      absolute overlaps (Hungarian algorithm). The sign of the matched overlap is
+      accumulated to keep track of the phase of every state.
+    While the overlaps of one step are computed, the next directory is parsed in a
+      separate process.
+    """
+    def __init__(self, ioptions):
+        self.ioptions = ioptions
+        self.dirs = []
+        self.names = []
+        self.order = [] # signed 1-based state index of every followed state in every step, 0 if unassigned
+        self.minov = [] # smallest matched overlap in every step
+
+    def run(self, dirs):
+        from multiprocessing import Pool
+
+        with Pool(1, initializer=_follow_worker_init, initargs=(self.ioptions,)) as pool:
+            pending = pool.apply_async(_follow_worker_read, (dirs[0],))
+            prev = None
+            for istep, tdir in enumerate(dirs):
+                step = pending.get()
+                if istep + 1 < len(dirs):
+                    pending = pool.apply_async(_follow_worker_read, (dirs[istep+1],))
+
+                if prev is None:
+                    self.start(tdir, step)
+                else:
+                    self.add_step(tdir, prev, step)
+                prev = step
+
+    def start(self, tdir, step):
+        names, tdens, mo_mat, inv_mo_mat = step
+        self.names = names
+        self.ind = numpy.arange(len(names))
+        self.sign = numpy.ones(len(names), dtype=int)
+        self.append(tdir, 1.)
+
+    def add_step(self, tdir, prev, step):
+        """
+        Match the states of step to the states of the previous step prev.
+        """
+        SMO = numpy.dot(prev[3], step[2])
+        OV = ret_tden_ov(prev[1], step[1], SMO)
+        norm1 = numpy.sqrt(numpy.sum(prev[1]**2, axis=(1,2)))
+        norm2 = numpy.sqrt(numpy.sum(step[1]**2, axis=(1,2)))
+        with numpy.errstate(divide='ignore', invalid='ignore'):
+            OV = numpy.nan_to_num(OV / numpy.outer(norm1, norm2))
+
+        cols = lib_util.ret_assignment(-abs(OV))
+
+        # follow the states of the first step
+        valid = self.ind >= 0
+        ind = -numpy.ones(len(self.ind), dtype=int)
+        ind[valid] = cols[self.ind[valid]]
+        valid = ind >= 0
+        sel = OV[self.ind[valid], ind[valid]]
+        self.sign[valid] *= numpy.where(sel < 0., -1, 1)
+        self.ind = ind
+
+        minov = numpy.min(abs(sel)) if len(sel) > 0 else 0.
+        if self.ioptions['lvprt'] >= 1:
+            print("%s: minimal overlap %.4f"%(tdir, minov))
+        self.append(tdir, minov)
+
+    def append(self, tdir, minov):
+        self.dirs.append(tdir)
+        self.order.append(numpy.where(self.ind >= 0, self.sign * (self.ind + 1), 0))
+        self.minov.append(minov)
+
+    def write(self, outfile):
+        """
+        Write the table of state indices.
+        Every line contains the indices (starting at 1) of the followed states in
+          the respective directory, with the sign denoting the relative phase.
+        States that could not be assigned are marked by '-'.
+        """
+        dlen = max([len(tdir) for tdir in self.dirs] + [9])
+        fmt = "%%-%is"%dlen + "%8s" * len(self.names) + "%8s\n"
+        with open(outfile, 'w') as f:
+            f.write(fmt%(('directory',) + tuple(self.names) + ('minOV',)))
+            for tdir, order, minov in zip(self.dirs, self.order, self.minov):
+                f.write("%%-%is"%dlen%tdir + "".join("%+8i"%i if i != 0 else "%8s"%'-' for i in order) + "%8.4f\n"%minov)
+
+        print("State indices written to %s"%outfile)
+
+
+_follow_worker_data = {}
+
+def _follow_worker_init(ioptions):
+    _follow_worker_data['ioptions'] = ioptions
+
+def _follow_worker_read(tdir):
+    """
+    Read the MOs and 1TDMs from a directory.
+    Returns the state names, the stacked 1TDMs, and the MO matrix and its inverse.
+    """
+    ioptions = _follow_worker_data['ioptions']
+    sdir = os.getcwd()
+    os.chdir(tdir)
+    try:
+        tdena = lib_tden.tden_ana(ioptions)
+        if 'mo_file' in ioptions:
+            tdena.read_mos(lvprt=0)
+        tdena.read_dens()
+    finally:
+        os.chdir(sdir)
+
+    if getattr(tdena, 'mos', None) is None:
+        raise error_handler.MsgError("MO coefficients required for state following in %s"%tdir)
+    tdena.mos.compute_inverse(lvprt=0)
+
+    names = [state['name'] for state in tdena.state_list]
+    tdens = numpy.array([state['tden'] for state in tdena.state_list], dtype=float)
+    return names, tdens, tdena.mos.mo_mat, tdena.mos.inv_mo_mat
@@ -12,7 +12,6 @@ with LazyImportCreator() as importer:
     input_options = importer.lazy_import_as('..input_options', 'input_options')
     lib_struc = importer.lazy_import_as('..lib_struc', 'lib_struc')
     error_handler = importer.lazy_import_as('..error_handler', 'error_handler')
-    orbkit_interface = importer.lazy_import_as('..orbkit_interface', 'orbkit_interface')
 
 
 class write_options_theo(input_options.write_options):
@@ -331,21 +330,20 @@ class write_options_theo(input_options.write_options):
                 self.read_yn('NTOs in Molden format', 'molden_orbitals', False)
             if self['molden_orbitals']:
                 self.read_yn('Use alpha/beta rather then negative/positive to code for hole/particle orbitals?', 'alphabeta', False)
-            if orbkit_interface.orbkit_avail:
-                self.read_yn('NTOs in Cube file format (requires orbkit)', 'cube_orbitals', False)
-                if self['cube_orbitals']:
-                    self.read_yn('Create VMD Network for NTOs', 'vmd_ntos', False)
-                    if self['vmd_ntos']:
-                        self.read_float('Isosurface value for VMD network', 'vmd_ntos_iv', 0.01)
-                self.read_yn('Calculation of Particle/Hole density (requires orbkit)?', 'comp_p_h_dens', False)
-                if self['comp_p_h_dens']:
-                    self.read_yn('Create VMD Network for p/h densities', 'vmd_ph_dens', False)
-                    if self['vmd_ph_dens']:
-                        self.read_float('Isosurface value for VMD network', 'vmd_ph_dens_iv', 0.01)
-                if self['comp_dntos']:
-                    self.read_int('Compute conditional densities as cube files?\n 0 - no, 1 - hole, 2 - electron, 3 - both', 'comp_dnto_dens', 0)
-                    if self['rtype'] == 'fchk':
-                        self.read_int('Write conditional densities to fchk file\n 0 - no, 1 - hole, 2 - electron, 3 - both', 'fchk_dnto_dens', 0)
+            self.read_yn('NTOs in Cube file format', 'cube_orbitals', False)
+            if self['cube_orbitals']:
+                self.read_yn('Create VMD Network for NTOs', 'vmd_ntos', False)
+                if self['vmd_ntos']:
+                    self.read_float('Isosurface value for VMD network', 'vmd_ntos_iv', 0.01)
+            self.read_yn('Calculation of Particle/Hole density?', 'comp_p_h_dens', False)
+            if self['comp_p_h_dens']:
+                self.read_yn('Create VMD Network for p/h densities', 'vmd_ph_dens', False)
+                if self['vmd_ph_dens']:
+                    self.read_float('Isosurface value for VMD network', 'vmd_ph_dens_iv', 0.01)
+            if self['comp_dntos']:
+                self.read_int('Compute conditional densities as cube files?\n 0 - no, 1 - hole, 2 - electron, 3 - both', 'comp_dnto_dens', 0)
+                if self['rtype'] == 'fchk':
+                    self.read_int('Write conditional densities to fchk file\n 0 - no, 1 - hole, 2 - electron, 3 - both', 'fchk_dnto_dens', 0)
         else:
             self.ostr += 'comp_ntos=False\n'
 
@@ -379,14 +377,12 @@ class write_options_theo(input_options.write_options):
         self.read_yn('Mayer bond order and valence analysis?', 'BO_ana', True)
 
     def comp_rho0n(self):
-        if not orbkit_interface.orbkit_avail:
-            return
         if self['rtype'] in ['adf', 'tddftb', 'onetep']:
             return
         if self['read_libwfa'] == True:
             return
 
-        self.read_yn('Calculation of transition densities between ground state and excited states (requires orbkit)', 'comp_rho0n', False)
+        self.read_yn('Calculation of transition densities between ground state and excited states', 'comp_rho0n', False)
         if self['comp_rho0n']:
             self.read_yn('Create VMD Network for transition densities', 'vmd_rho0n', False)
             if self['vmd_rho0n']:
@@ -460,7 +456,7 @@ def run_theoinp():
             wopt.comp_rho0n()
             try:
                 if wopt['comp_rho0n'] or wopt['cube_orbitals'] or wopt['comp_p_h_dens']:
-                    wopt.read_int('Number of CPUs for orbkit calculations','numproc', 4)
+                    wopt.read_int('Number of CPUs for grid calculations','numproc', 4)
             except error_handler.MsgError:
                 pass
 
@@ -506,7 +502,6 @@ class TheodoreInput(Action):
             '..input_options': 'input_options',
             '..lib_struc': 'lib_struc',
             '..error_handler': 'error_handler',
-            '..orbkit_interface': 'orbkit_interface',
     })
 
     def run():
@@ -80,6 +80,7 @@ class vmd_options(input_options.write_options):
     def write_lfile(self, pltfiles, auxfiles=[]):
         """
         File for loading data.
+        Binary cube files are converted to text cube files, which can be read by VMD.
         """
         lf = open(self['lfile'], 'w')
         lf.write("""material change opacity Glass3 0.150000
@@ -120,32 +121,36 @@ mol modcolor 4 0 ColorID 1
 """%(self['mat2'], self['mat2'], iso2, iso2))
 
         struc = lib_struc.structure()
-        for pltf in pltfiles:
-            ftyp = struc.guess_file_type(pltf)
-            lf.write("mol addfile %s type %s\n"%(pltf,ftyp))
-        for pltf in auxfiles:
+        for pltf in pltfiles + auxfiles:
+            pltf = lib_util.ret_text_cube(pltf, lvprt=1)
             ftyp = struc.guess_file_type(pltf)
             lf.write("mol addfile %s type %s\n"%(pltf,ftyp))
 
         lf.close()
         print("File %s written."%lf.name)
 
-    def write_pfile(self, pltfiles, auxfiles=[]):
+    def write_pfile(self, pltfiles, auxfiles=[], numproc=1):
         """
         File used for plotting.
+        The volume integrals over the cube files are computed with numproc processes.
         """
         iso1 = self['iso1']
         iso2 = self['iso2']
+        if self['do_vol']:
+            isovals_list = lib_util.ret_isovals_list(pltfiles, [self['iso1'], self['iso2']], numproc, lvprt=1)
+            if self['dnto']:
+                auxisovals_list = lib_util.ret_isovals_list(auxfiles, [self['iso2']], numproc, lvprt=1)
+
         pf = open(self['pfile'], 'w')
         for iplt, pltf in enumerate(pltfiles):
             if self['do_vol']:
-                isovals = lib_util.cube_file(pltf).ret_isovals([self['iso1'], self['iso2']], lvprt=1)
+                isovals = isovals_list[iplt]
                 iso1 = isovals[0]
             pf.write("mol modstyle 1 0 Isosurface  %.5f %i 0 0 1 1\n"%(iso1, iplt))
             pf.write("mol modstyle 2 0 Isosurface -%.5f %i 0 0 1 1\n"%(iso1, iplt))
             if self['dnto']:
                 if self['do_vol']:
-                    iso2 = lib_util.cube_file(auxfiles[iplt]).ret_isovals([self['iso2']], lvprt=1)[0]
+                    iso2 = auxisovals_list[iplt][0]
                 pf.write("mol modstyle 3 0 Isosurface  %.5f %i 0 0 1 1\n"%(iso2, iplt + len(pltfiles)))
                 pf.write("mol modstyle 4 0 Isosurface -%.5f %i 0 0 1 1\n"%(iso2, iplt + len(pltfiles)))
             elif self['niso'] >= 2:
@@ -197,8 +202,10 @@ class VMDPlots(Action):
     _colt_description = 'Automatic plotting of cube files in VMD'
 
     _user_input = """
-    # List of cube files (or other format VMD can read)
+    # List of cube files (text or binary .cbz, or other format VMD can read)
     pltfiles = :: list(existing_file)
+    # Number of processes for computing the volume integrals
+    numproc = 1 :: int, alias=n
     """
 
     _lazy_imports = LazyImporter({
@@ -210,7 +217,7 @@ class VMDPlots(Action):
             '..lib_util': 'lib_util',
     })
 
-    def run(pltfiles):
+    def run(pltfiles, numproc):
         theo_header.print_header(title=__class__._colt_description)
 
         print('%i Files analyzed:' % len(pltfiles), end=' ')
@@ -223,14 +230,14 @@ class VMDPlots(Action):
             pltfiles, auxfiles = vopt.mod_pltfiles(pltfiles)
 
         vopt.write_lfile(pltfiles, auxfiles)
-        vopt.write_pfile(pltfiles, auxfiles)
+        vopt.write_pfile(pltfiles, auxfiles, numproc)
         vopt.write_cfile(pltfiles)
         vopt.write_hfile(pltfiles)
 
         print("Converting coordinate file ...")
         struc = lib_struc.structure()
         try:
-            struc.read_file(file_path=pltfiles[0], file_type=None)
+            struc.read_file(file_path=lib_util.ret_text_cube(pltfiles[0]), file_type=None)
             struc.make_coord_file(file_path='coord.xyz',file_type='xyz',lvprt=1)
         except:
             print("*** WARNING: The coordinate file coord.xyz could not be created. ***")
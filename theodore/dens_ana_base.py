@@ -1,5 +1,6 @@
 from __future__ import print_function, division
 from . import file_parser, lib_mo, error_handler, cclib_interface, fchk_parser, units, lib_struc
+import os
 import numpy
 
 class dens_ana_base:
@@ -14,6 +15,9 @@ class dens_ana_base:
 
         self.ioptions = ioptions
 
+        # interface to orbkit, which keeps the AO values on the grid
+        self.lib_orbkit = None
+
 #--------------------------------------------------------------------------#
 # Input
 #--------------------------------------------------------------------------#
@@ -156,6 +160,23 @@ class dens_ana_base:
                 print("Number of atoms: %i"%num_at)
                 print("Composition: %s\n"%self.struc.ret_at_list_composition(list(range(1, num_at+1))))
 
+    def ret_lib_orbkit(self):
+        """
+        Return the orbkit interface.
+        The same instance is used for all states so that the AO values on the grid are reused.
+        """
+        if self.lib_orbkit is None:
+            from . import orbkit_interface
+            self.lib_orbkit = orbkit_interface.lib_orbkit(ao_cache=self.ioptions.get('ao_cache', strict=False),
+                                                          ao_thresh=self.ioptions['ao_thresh'],
+                                                          ao_store=self.ioptions['ao_store'],
+                                                          extend=self.ioptions['grid_extend'],
+                                                          step=self.ioptions['grid_step'],
+                                                          resume=self.ioptions['cube_resume'],
+                                                          binary=self.ioptions['cube_binary'],
+                                                          dtype=self.ioptions['cube_dtype'])
+        return self.lib_orbkit
+
     def select_states(self, ana_states, state_list):
         """
         Analyze only the states given in 'ana_states'
@@ -195,59 +216,109 @@ class dens_ana_base:
         if 'output_file' in self.ioptions:
             ofile = self.ioptions.get('output_file')
             print("Final output copied to %s"%ofile)
-            open(ofile, 'w').write(ostr)
+            with open(ofile, 'w') as f:
+                f.write(ostr)
+
+            if self.ioptions['output_bin']:
+                bfile = os.path.splitext(ofile)[0] + '.npy'
+                numpy.save(bfile, self.ret_summ_array(self.ioptions.get('prop_list')))
+                print("Binary table written to %s"%bfile)
 
     def ret_summ_table(self, prop_list):
+        return ''.join(self.ret_summ_lines(prop_list))
+
+    def write_summ_table(self, f, prop_list):
+        """
+        Write the summary table to the open file f.
+        """
+        f.writelines(self.ret_summ_lines(prop_list))
+
+    def ret_summ_lines(self, prop_list):
+        """
+        Return the lines of the summary table.
+        """
+        hstr, prt_list = self.ret_summ_rows(prop_list)
+
+        return [hstr + "\n", len(hstr) * '-' + "-\n"] + [vstr + "\n" for en, vstr, i in prt_list]
+
+    def ret_summ_rows(self, prop_list):
+        """
+        Return the header and a list with [exc_en, vstr, index in state_list]
+          for all rows of the summary table, in the order in which they are printed.
+        """
         width, ndec = self.ioptions.get('output_prec')
         oformat = '%% %i.%if'%(width, ndec)
+        nostr = '%*s'%(width, '-')
+        nofstr = oformat%(-1.)
 
         hstr  = '%-10s'%'state' + '%*s'%(width+1, 'dE(eV)') + '%*s'%(width-2, 'f')
         hstr +=self.ret_header_string(prop_list, width)
 
         prt_list = []
         for state in self.state_list:
-            vstr  = '%-10s'%state['name'][-10:]
-            vstr += oformat%state['exc_en']
             try:
-                vstr += (oformat%state['osc_str']).replace(oformat%(-1.),'%*s'%(width, '-'))
+                fstr = (oformat%state['osc_str']).replace(nofstr, nostr)
             except KeyError:
-                vstr += '%*s'%(width, '-')
+                fstr = nostr
 
-            vstr += self.ret_val_string(prop_list, state, oformat)
+            vstr = '%-10s'%state['name'][-10:] + oformat%state['exc_en'] + fstr \
+                 + self.ret_val_string(prop_list, state, oformat)
 
-            prt_list.append([state['exc_en'], vstr])
+            prt_list.append([state['exc_en'], vstr, len(prt_list)])
 
         if self.ioptions['print_sorted']: prt_list.sort()
 
-        ostr  = hstr + "\n"
-        ostr += len(hstr) * '-' + "-\n"
-        for en, vstr in prt_list:
-            ostr += vstr + "\n"
-        return ostr
-
-    def ret_header_string(self, prop_list, width=7):
-        ret_str = ''
+        return hstr, prt_list
 
+    def ret_summ_array(self, prop_list):
+        """
+        Return the summary as structured array with one field for the state name
+          and one float field each for dE(eV), f, and the entries of prop_list.
+        Missing values are set to NaN and repeated properties are only stored once.
+        The states are arranged as in ret_summ_table.
+        """
+        fields = ['state', 'dE(eV)', 'f']
         for prop in prop_list:
-            ret_str += '%*s'%(width, prop)
+            if not prop in fields:
+                fields.append(prop)
+        dtype = [('state', 'U10')] + [(field, float) for field in fields[1:]]
+
+        hstr, prt_list = self.ret_summ_rows(prop_list)
+        states = [self.state_list[i] for en, vstr, i in prt_list]
+
+        summ = numpy.full(len(states), numpy.nan, dtype=dtype)
+        for i, state in enumerate(states):
+            row = [state['name'][-10:], state['exc_en'], state.get('osc_str', -1.)]
+            row += [self.ret_prop_val(prop, state) for prop in fields[3:]]
+            if row[2] == -1.:
+                row[2] = None
+            for field, val in zip(summ.dtype.names, row):
+                try:
+                    summ[field][i] = val
+                except (TypeError, ValueError):
+                    pass
 
-        return ret_str
+        return summ
+
+    def ret_header_string(self, prop_list, width=7):
+        return ''.join('%*s'%(width, prop) for prop in prop_list)
 
     def ret_val_string(self, prop_list, state, oformat='% 7.3f'):
-        ret_str = ''
+        nostr = (len(oformat%(0.0))-1)*' ' + '-'
+        ret_list = []
 
         for prop in prop_list:
             val = self.ret_prop_val(prop, state)
 
             if val == None:
-                ret_str += (len(oformat%(0.0))-1)*' ' + '-'
+                ret_list.append(nostr)
             else:
                 try:
-                    ret_str += oformat%val
+                    ret_list.append(oformat%val)
                 except:
-                    ret_str += ' ' + val
+                    ret_list.append(' ' + val)
 
-        return ret_str
+        return ''.join(ret_list)
 
     def ret_prop_val(self, prop, state):
         """
@@ -1600,29 +1600,20 @@ class file_parser_nos(file_parser_base):
     Interpret the MO-file as a diagonal density.
     """
     def read(self, mos):
-        state_list = []
+        ana_files = self.ioptions['ana_files']
+        ref_inv = mos.ret_mo_mat(trnsp=False, inv=True)
 
-        for no_file in self.ioptions['ana_files']:
-            state_list.append({})
-            state = state_list[-1]
-            if not self.ioptions['unrestricted']:
-                state['sden'] = self.read_no_file(state, mos, no_file)
-            else:
-                # TODO: One could compute the spin-density here
-                state['sden_a'] = self.read_no_file(state, mos, no_file, spin=1)
-                try:
-                    state['sden_b'] = self.read_no_file(state, mos, no_file, spin=-1)
-                except IndexError:
-                    print("  WARNING: Could not find beta orbitals.")
-                    print("  Setting beta=alpha")
-                    state['sden_b'] = state['sden_a']
-                state['sden']   = state['sden_a'] + state['sden_b']
+        numproc = self.ioptions['numproc']
+        if numproc > 1 and len(ana_files) > 1:
+            state_list = self.read_parallel(ref_inv, numproc)
+        else:
+            state_list = [self.read_state(ref_inv, no_file) for no_file in ana_files]
 
         for istate, state in enumerate(state_list):
             state['exc_en'] = float(istate + 1) # set fake excitation energy
             state['state_num'] = istate + 1
 
-            state['fname'] = self.ioptions['ana_files'][istate]
+            state['fname'] = ana_files[istate]
 
             # perform some simplifications to the filename
             # for Columbus:
@@ -1637,9 +1628,55 @@ class file_parser_nos(file_parser_base):
 
         return state_list
 
-    def read_no_file(self, state, ref_mos, no_file, spin=0):
+    def read_parallel(self, ref_inv, numproc):
+        """
+        Distribute the NO files over a pool of worker processes.
+        The inverse reference MO matrix is shared read-only via shared memory.
+        The states are returned in the order of ana_files.
+        """
+        from multiprocessing import Pool, shared_memory
+
+        ana_files = self.ioptions['ana_files']
+        print("Reading %i NO files using %i processes ..."%(len(ana_files), numproc))
+
+        shm = shared_memory.SharedMemory(create=True, size=ref_inv.nbytes)
+        try:
+            shared_inv = numpy.ndarray(ref_inv.shape, dtype=ref_inv.dtype, buffer=shm.buf)
+            shared_inv[:] = ref_inv
+            initargs = (self.ioptions, shm.name, ref_inv.shape, ref_inv.dtype.str)
+            with Pool(numproc, initializer=_nos_worker_init, initargs=initargs) as pool:
+                state_list = pool.map(_nos_worker_read, ana_files, chunksize=1)
+            del shared_inv
+        finally:
+            shm.close()
+            shm.unlink()
+
+        return state_list
+
+    def read_state(self, ref_inv, no_file):
+        """
+        Read one NO file and return the corresponding state.
+        """
+        state = {}
+        if not self.ioptions['unrestricted']:
+            state['sden'] = self.read_no_file(state, ref_inv, no_file)
+        else:
+            # TODO: One could compute the spin-density here
+            state['sden_a'] = self.read_no_file(state, ref_inv, no_file, spin=1)
+            try:
+                state['sden_b'] = self.read_no_file(state, ref_inv, no_file, spin=-1)
+            except IndexError:
+                print("  WARNING: Could not find beta orbitals.")
+                print("  Setting beta=alpha")
+                state['sden_b'] = state['sden_a']
+            state['sden']   = state['sden_a'] + state['sden_b']
+
+        return state
+
+    def read_no_file(self, state, ref_inv, no_file, spin=0):
         """
         Read information from a secondary NO file.
+        ref_inv is the inverse of the reference MO matrix.
         """
         nos = lib_mo.MO_set_molden(file=no_file)
         nos.read(spin=spin)
@@ -1673,7 +1710,7 @@ class file_parser_nos(file_parser_base):
                     if self.ioptions['lvprt'] >= 2: print(("Discarding MO %i"%(imo+1)))
             print("%i NOs selected."%ntake)
 
-        T = numpy.dot(ref_mos.ret_mo_mat(trnsp=False, inv=True), nos.mo_mat)
+        T = numpy.dot(ref_inv, nos.mo_mat)
 
         if not self.ioptions['unrestricted']:
             nu_list = [min(occ, 2.-occ) for occ in nos.occs]
@@ -1700,6 +1737,20 @@ class file_parser_nos(file_parser_base):
 
         return numpy.dot(T, numpy.dot(numpy.diag(nos.occs), T.transpose()))
 
+# Worker functions for file_parser_nos.read_parallel
+#   these have to be defined at module level to be usable in a process pool
+_nos_worker_data = {}
+
+def _nos_worker_init(ioptions, shm_name, shape, dtype):
+    from multiprocessing import shared_memory
+    shm = shared_memory.SharedMemory(name=shm_name)
+    _nos_worker_data['shm'] = shm
+    _nos_worker_data['ref_inv'] = numpy.ndarray(shape, dtype=dtype, buffer=shm.buf)
+    _nos_worker_data['parser'] = file_parser_nos(ioptions)
+
+def _nos_worker_read(no_file):
+    return _nos_worker_data['parser'].read_state(_nos_worker_data['ref_inv'], no_file)
+
 class file_parser_rassi(file_parser_libwfa):
     def read(self, mos):
 
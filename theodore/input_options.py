@@ -405,6 +405,7 @@ class dens_ana_options(read_options):
         self['mcfmt']          = '% 10E' # format for molden coefficients
         self['output_prec']   = (7,3) # number of digits and decimal digits for output summary
         self['print_sorted']  = True  # final output sorted by energies
+        self['output_bin']    = False # also write the summary as binary table (.npy) for fast read-in
 
         # tden analysis
         self['Om_formula'] = 1
@@ -437,6 +438,15 @@ class dens_ana_options(read_options):
         self['vmd_rho0n_iv'] = 0.01
         self['comp_rho'] = False # compute densities and unpaired densities
         self['numproc'] = 1
+        self['ao_cache'] = None # file for memory-mapping the AO values on the grid
+        self['ao_thresh'] = 0. # neglect AO values below this threshold (distance screening)
+        self['ao_store'] = True # keep the AO values on the grid, otherwise recompute them for every slice
+        self['grid_step'] = 0.4 # grid spacing (bohr)
+        self['grid_extend'] = 5.0 # distance of the grid boundaries from the atoms (bohr)
+        self['cube_resume'] = False # skip cube files that already exist
+        self['cube_binary'] = False # write compressed binary cube files (.cbz) instead of text
+        self['cube_dtype'] = 'float32' # data type of the values in binary cube files (float32, float64)
+        self['exc_grid'] = False # exciton descriptors (dexc, dH-E, sigH, sigE, COV, Corr) from the 1TDM by grid quadrature
         self['comp_dnto_dens'] = 0 # compute cube files for DNTO densities
             # 0 - none, 1 - only hole, 2 - only electron, 3 - both
         self['fchk_dnto_dens'] = 0  # Print densities to the fchk file
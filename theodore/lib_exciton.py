@@ -3,63 +3,172 @@ from __future__ import print_function, division
 from . import lib_struc, error_handler, units
 import numpy
 
+# Properties that are computed by the exciton analysis
+# The atom-discretized e/h descriptors carry the suffix _at to keep them apart
+#   from the exact values parsed from libwfa or computed on the grid
+exciton_props = ['RMSeh', 'MAeh', 'Eb', 'dH-E_at', 'sigH_at', 'sigE_at', 'COV_at', 'Corr_at']
+
 class exciton_analysis:
     """
     Perform analysis of an effective exciton wavefunction.
     Approximate atom centered solutions.
     """
-    # TODO: add correlation coefficient and covariance
-    #   use the same moment construction as in the JCC paper, only discretized
-    
     def __init__(self):
+        self.coor = None
         self.distmat = None
-    
-    def get_distance_matrix(self, struc):
+        self.kernels = None # flattened d^2, d, 1/d kernels as columns
+        self.Eb_diag = None
+
+    def get_distance_matrix(self, struc, Eb_diag=1.0):
+        self.coor = struc.ret_3xN_matrix()
         self.distmat = struc.ret_distance_matrix()
-                        
-    def ret_RMSeh(self, Om, OmAt):
+        self.set_kernels(Eb_diag)
+
+    def set_kernels(self, Eb_diag=1.0):
         """
-        Return the root mean square electron-hole distance (Ang).
+        Precompute the distance kernels for the current structure:
+          d^2 (Ang^2), d (Ang), and 1/d (1/bohr) with Eb_diag (bohr) on the diagonal.
+        They are stored as the columns of a (num_at**2, 3) matrix.
         """
         if not type(self.distmat) is numpy.ndarray:
             raise error_handler.MsgError("Compute the distance matrix first!")
-        
+
+        d = self.distmat.flatten()
+
+        Eb_dist = d / units.length['A']
+        Eb_dist[::len(self.distmat)+1] = Eb_diag
+
+        self.kernels = numpy.array([d * d, d, Eb_dist**-1.]).T
+        self.Eb_diag = Eb_diag
+
+    def chk_kernels(self, Eb_diag=None):
+        if self.kernels is None or (not Eb_diag is None and Eb_diag != self.Eb_diag):
+            self.set_kernels(self.Eb_diag if Eb_diag is None else Eb_diag)
+
+    def ret_moments(self, Oms, OmAts, Eb_diag=None):
+        """
+        Contract the stacked OmAt matrices of all states with all kernels at once.
+        Returns a (nstate, 3) array with <d^2>, <d>, <1/d>.
+        """
+        self.chk_kernels(Eb_diag)
+
+        Oms = numpy.asarray(Oms, float)
+        OmAts = numpy.asarray(OmAts, float)
         try:
-            MS_dist = numpy.dot(OmAt.flatten(), self.distmat.flatten()**2.) / Om
+            moms = numpy.dot(OmAts.reshape(len(Oms), -1), self.kernels)
         except:
-            print("\n Error when computing MS_dist!")
+            print("\n Error when computing the exciton moments!")
             print(" Please check the coordinate file.")
-            print(" OmAt: %i x %i"%(len(OmAt), len(OmAt[0])))
+            print(" OmAt: %s"%str(OmAts.shape[-2:]))
             print(" distmat: %i x %i"%(len(self.distmat), len(self.distmat[0])))
             raise
-        
-        RMS_dist = numpy.sqrt(MS_dist)
-        
-        return RMS_dist
+
+        return moms / Oms[:, None]
+
+    def ret_descriptors(self, Oms, OmAts, Eb_diag=1.0):
+        """
+        Return RMSeh (Ang), MAeh (Ang), and Eb (eV) as vectors over all states.
+        """
+        moms = self.ret_moments(Oms, OmAts, Eb_diag)
+
+        return numpy.sqrt(moms[:,0]), moms[:,1], moms[:,2] * units.energy['eV']
+
+    def ret_RMSeh(self, Om, OmAt):
+        """
+        Return the root mean square electron-hole distance (Ang).
+        """
+        MS_dist = self.ret_moments([Om], [OmAt])[0, 0]
+
+        return numpy.sqrt(MS_dist)
 
     def ret_MAeh(self, Om, OmAt):
         """
         Return the mean absolute electron-hole distance (Ang).
         """
-        if not type(self.distmat) is numpy.ndarray:
-            raise error_handler.MsgError("Compute the distance matrix first!")
-        
-        MA_dist = numpy.dot(OmAt.flatten(), self.distmat.flatten()) / Om
-        
-        return MA_dist
+        return self.ret_moments([Om], [OmAt])[0, 1]
 
     def ret_Eb(self, Om, OmAt, Eb_diag=1.0):
         """
         Return an approximate exciton binding energy (eV).
         """
-        if not type(self.distmat) is numpy.ndarray:
-            raise error_handler.MsgError("Compute the distance matrix first!")
-        
-        Eb_dist = self.distmat.flatten() / units.length['A']
-        
-        for i in range(len(self.distmat)):
-            Eb_dist[i + i*len(self.distmat)] = Eb_diag
-            
-        Eb_au = numpy.dot(OmAt.flatten(), Eb_dist**-1.) / Om
-        
+        Eb_au = self.ret_moments([Om], [OmAt], Eb_diag)[0, 2]
+
         return Eb_au * units.energy['eV']
+
+    def ret_eh_descriptors(self, Oms, OmAts):
+        """
+        Return the e/h distance, sizes, covariance and correlation coefficient
+          for all states at once.
+        The moment construction of the JCC paper (JCC 2015, 36, 1609) is used,
+          discretized by placing the hole and electron on the atom centers.
+          The on-atom contributions to sigH and sigE are therefore neglected.
+        Returns a dictionary with vectors over the states for
+          dH-E_at, sigH_at, sigE_at (Ang), COV_at (Ang^2), and Corr_at.
+        """
+        if not type(self.coor) is numpy.ndarray:
+            raise error_handler.MsgError("Read the coordinates first!")
+
+        Oms = numpy.asarray(Oms, float)
+        nstate = len(Oms)
+        OmNorm = numpy.asarray(OmAts, float) / Oms[:, None, None]
+
+        hpop = numpy.sum(OmNorm, 2)
+        epop = numpy.sum(OmNorm, 1)
+        R2 = numpy.sum(self.coor * self.coor, 1)
+
+        rh  = numpy.dot(hpop, self.coor) # <r_h>
+        re  = numpy.dot(epop, self.coor) # <r_e>
+        rh2 = numpy.dot(hpop, R2) # <r_h^2>
+        re2 = numpy.dot(epop, R2) # <r_e^2>
+        rhre = numpy.dot(OmNorm.reshape(nstate, -1),
+                         numpy.dot(self.coor, self.coor.T).flatten()) # <r_h . r_e>
+
+        ret_dict = {}
+        dHE = re - rh
+        ret_dict['dH-E_at'] = numpy.sqrt(numpy.sum(dHE * dHE, 1))
+        ret_dict['sigH_at'] = numpy.sqrt(numpy.maximum(rh2 - numpy.sum(rh * rh, 1), 0.))
+        ret_dict['sigE_at'] = numpy.sqrt(numpy.maximum(re2 - numpy.sum(re * re, 1), 0.))
+        ret_dict['COV_at']  = rhre - numpy.sum(rh * re, 1)
+
+        sigHE = ret_dict['sigH_at'] * ret_dict['sigE_at']
+        ret_dict['Corr_at'] = numpy.zeros(nstate)
+        numpy.divide(ret_dict['COV_at'], sigHE, out=ret_dict['Corr_at'], where=sigHE > 1.e-8)
+
+        return ret_dict
+
+    def ret_grid_descriptors(self, Ds, moms):
+        """
+        Return the exact exciton descriptors for all states at once.
+        Ds   - 1TDMs in the AO basis (nstate, nao, nao), hole index first
+        moms - AO overlap, dipole, and r^2 matrices (5, nao, nao) in bohr,
+                 e.g. computed by quadrature on a grid
+        Returns a dictionary with vectors over the states for
+          dexc, dH-E, sigH, sigE (Ang), COV (Ang^2), and Corr.
+        """
+        Ds = numpy.asarray(Ds, float)
+        S, M, Q = moms[0], moms[1:4], moms[4]
+
+        DS = numpy.matmul(Ds, S)
+        SD = numpy.matmul(S, Ds)
+        Oms = numpy.sum(Ds * numpy.matmul(S, DS), (1, 2))
+
+        rh  = numpy.array([numpy.sum(Ds * numpy.matmul(Mk, DS), (1, 2)) for Mk in M]).T / Oms[:, None]
+        re  = numpy.array([numpy.sum(Ds * numpy.matmul(SD, Mk), (1, 2)) for Mk in M]).T / Oms[:, None]
+        rh2 = numpy.sum(Ds * numpy.matmul(Q, DS), (1, 2)) / Oms
+        re2 = numpy.sum(Ds * numpy.matmul(SD, Q), (1, 2)) / Oms
+        rhre = sum(numpy.sum(Ds * numpy.matmul(numpy.matmul(Mk, Ds), Mk), (1, 2)) for Mk in M) / Oms
+
+        A = units.length['A']
+        ret_dict = {}
+        dHE = re - rh
+        ret_dict['dexc'] = numpy.sqrt(numpy.maximum(rh2 + re2 - 2. * rhre, 0.)) * A
+        ret_dict['dH-E'] = numpy.sqrt(numpy.sum(dHE * dHE, 1)) * A
+        ret_dict['sigH'] = numpy.sqrt(numpy.maximum(rh2 - numpy.sum(rh * rh, 1), 0.)) * A
+        ret_dict['sigE'] = numpy.sqrt(numpy.maximum(re2 - numpy.sum(re * re, 1), 0.)) * A
+        ret_dict['COV']  = (rhre - numpy.sum(rh * re, 1)) * A * A
+
+        sigHE = ret_dict['sigH'] * ret_dict['sigE']
+        ret_dict['Corr'] = numpy.zeros(len(Oms))
+        numpy.divide(ret_dict['COV'], sigHE, out=ret_dict['Corr'], where=sigHE > 1.e-8)
+
+        return ret_dict
@@ -1,6 +1,8 @@
 from __future__ import print_function, division
 
 from . import error_handler
+import os
+import numpy
 
 """
 General file manipulation classes.
@@ -48,12 +50,13 @@ class wfile:
 class wtable:
     """
     Virtual class with routines for creating a general table.
+    The pieces of the table are collected in a list and only joined at the end.
     """
     def __init__(self, ncol=2):
         self.ncol = ncol
         self.icol = 0
 
-        self.str = self.init_extra()
+        self.parts = [self.init_extra()]
 
     def init_extra(self):
         return ''
@@ -63,10 +66,10 @@ class wtable:
         Add an element
         """
         if self.icol == self.ncol:
-            self.str += self.new_row()
+            self.parts.append(self.new_row())
             self.icol = 0
 
-        self.str += self.new_el(el)
+        self.parts.append(self.new_el(el))
 
         self.icol += 1
 
@@ -82,6 +85,13 @@ class wtable:
         for el in row_list:
             self.add_el(el)
 
+    def add_rows(self, rows):
+        """
+        Add several rows at once.
+        """
+        for row_list in rows:
+            self.add_row(row_list)
+
     def new_row(self):
         raise error_handler.PureVirtualError()
 
@@ -89,9 +99,17 @@ class wtable:
         raise error_handler.PureVirtualError()
 
     def ret_table(self):
-        self.str += self.close_table()
+        self.parts.append(self.close_table())
+
+        return ''.join(self.parts)
+
+    def write_table(self, f):
+        """
+        Close the table and write it to the open file f.
+        """
+        self.parts.append(self.close_table())
 
-        return self.str
+        f.writelines(self.parts)
 
     def close_table(self):
         raise error_handler.PureVirtualError()
@@ -106,6 +124,26 @@ class asciitable(wtable):
     def new_el(self, el):
         return '% .6f'%el
 
+    def add_rows(self, rows):
+        """
+        Add several rows at once.
+        All values are formatted with one format string.
+        """
+        rows = numpy.asarray(rows, dtype=float)
+        if len(rows) == 0:
+            return
+        assert rows.shape[1] == self.ncol
+        if not self.icol in [0, self.ncol]:
+            wtable.add_rows(self, rows)
+            return
+
+        if self.icol == self.ncol:
+            self.parts.append(self.new_row())
+
+        rfmt = '% .6f' * self.ncol
+        self.parts.append(((rfmt + '\n') * (len(rows) - 1) + rfmt)%tuple(rows.ravel().tolist()))
+        self.icol = self.ncol
+
     def close_table(self):
         return '\n'
 
@@ -203,14 +241,68 @@ class latextabular(wtable):
     def close_table(self):
         return "\n\\end{tabular}\n"
 
+def write_OmFrag(fname, names, Oms, OmFrags, binary=False):
+    """
+    Write the Omega matrices with respect to fragments to the OmFrag.txt file.
+    Every line contains the state name, Omega, and the flattened OmFrag matrix.
+    binary=True: also write the data to a .npz sidecar file, which is read by read_OmFrag.
+    """
+    OmFrags = numpy.asarray(OmFrags, float) # (nstate, numF, numF)
+    numF = OmFrags.shape[1]
+    lfmt = "%10s %8.5f" + " %8.5f" * numF**2 + "\n"
+
+    with open(fname, 'w') as omf:
+        omf.write("%i\n"%numF)
+        omf.write(''.join(lfmt%((name, Om) + tuple(OmFrag.ravel().tolist()))
+                          for name, Om, OmFrag in zip(names, Oms, OmFrags)))
+
+    if binary:
+        with open(ret_OmFrag_sidecar(fname), 'wb') as f:
+            numpy.savez(f, names=numpy.array(names, dtype=str), Om=numpy.asarray(Oms, float), OmFrag=OmFrags)
+
+def ret_OmFrag_sidecar(fname):
+    return os.path.splitext(fname)[0] + '.npz'
+
+def read_OmFrag(fname='OmFrag.txt'):
+    """
+    Read the OmFrag.txt file written by analyze_tden.
+    If an up-to-date .npz sidecar file exists, the data are taken from there.
+    Returns the state names, Omega values (nstate), and OmFrag matrices (nstate, numF, numF).
+    """
+    sname = ret_OmFrag_sidecar(fname)
+    if os.path.exists(sname) and os.path.getmtime(sname) >= os.path.getmtime(fname):
+        with numpy.load(sname) as data:
+            return [str(name) for name in data['names']], data['Om'], data['OmFrag']
+
+    with open(fname, 'r') as f:
+        numF = int(f.readline().split()[0])
+        lines = [line.split(None, 1) for line in f if line.strip() != '']
+
+    names = [line[0] for line in lines]
+    vals = numpy.fromstring(' '.join(line[1] for line in lines), dtype=float, sep=' ')
+    vals = vals.reshape(len(lines), 1 + numF**2)
+
+    return names, vals[:, 0], vals[:, 1:].reshape(len(lines), numF, numF)
+
 class summ_file:
     """
     Class for analyzing the summary files.
+    Text files as well as binary .npy files (written with output_bin=True) are
+      supported. The binary files are memory-mapped.
     """
     def __init__(self, fname):
-        self.ddict = {}
+        self._ddict = None
+        self.table = None
         self.state_labels = []
 
+        if fname.endswith('.npy'):
+            self.read_npy(fname)
+        else:
+            self.read_txt(fname)
+
+    def read_txt(self, fname):
+        self._ddict = {}
+
 #       try:
         f = open(fname, 'r')
 #        except IOError:
@@ -229,12 +321,12 @@ class summ_file:
 
             words = line.split()
             state_label = words[0]
-            if state_label in self.ddict:
+            if state_label in self._ddict:
                 errmsg  = "State %s already present.\n"%state_label
                 errmsg += "  Please, do not combine tden_summ.txt files here."
                 raise error_handler.MsgError(errmsg)
-            self.ddict[state_label] = {}
-            pdict = self.ddict[state_label]
+            self._ddict[state_label] = {}
+            pdict = self._ddict[state_label]
             self.state_labels.append(state_label)
 
             pdict['state'] = state_label
@@ -246,6 +338,33 @@ class summ_file:
 
         f.close()
 
+    def read_npy(self, fname):
+        self.table = numpy.load(fname, mmap_mode='r')
+        self.header = list(self.table.dtype.names)
+        self.state_labels = [str(label) for label in self.table['state']]
+        if len(set(self.state_labels)) < len(self.state_labels):
+            errmsg  = "Duplicate state labels in %s.\n"%fname
+            errmsg += "  Please, do not combine tden_summ files here."
+            raise error_handler.MsgError(errmsg)
+
+    @property
+    def ddict(self):
+        """
+        Dictionary {state_label: {prop: value}}.
+        For binary files, this is only constructed on demand and missing (NaN)
+          values are left out as in the text files.
+        """
+        if self._ddict is None:
+            self._ddict = {}
+            cols = [self.table[prop] for prop in self.header[1:]]
+            for i, state_label in enumerate(self.state_labels):
+                pdict = {'state': state_label}
+                for prop, col in zip(self.header[1:], cols):
+                    if not numpy.isnan(col[i]):
+                        pdict[prop] = float(col[i])
+                self._ddict[state_label] = pdict
+        return self._ddict
+
     def ret_header(self):
         return self.header
 
@@ -254,3 +373,105 @@ class summ_file:
 
     def ret_state_labels(self):
         return self.state_labels
+
+    def ret_column(self, prop):
+        """
+        Return the values of one property for all states as a float array.
+        Missing values are NaN.
+        """
+        if not prop in self.header[1:]:
+            raise error_handler.MsgError("Property %s not found in the summary file."%prop)
+        if self.table is None:
+            return numpy.array([self._ddict[state].get(prop, numpy.nan) for state in self.state_labels])
+        return numpy.asarray(self.table[prop], float)
+
+def read_nx_log(fname, nstate, tmin=0., tmax=None, props=None, nalloc=1024):
+    """
+    Read the TheoDORE tables from a Newton-X log file (nx.log).
+    The file is read line by line and only the tables of the time steps with
+      tmin <= time < tmax are parsed. Reading stops at the first step with time >= tmax.
+    props: list of properties to extract (default: all, plus ddE)
+      ddE, the energy relative to the first state, requires dE(eV), which is added if needed
+    Returns a dictionary with the entries
+      props  - list of properties
+      labels - state labels
+      times  - times of the steps (nstep)
+      act    - index of the active state (nstep)
+      vals   - property values (nstep, nstate, nprop), missing values are NaN
+    """
+    hline = None
+    labels = []
+    table = []
+    cols = []
+    nstep = 0
+    times = numpy.zeros(nalloc)
+    act = numpy.zeros(nalloc, dtype=int)
+    vals = None
+
+    f = open(fname, 'r')
+    while True:
+        try:
+            line = next(f)
+        except StopIteration:
+            break
+
+        if 'state       dE(eV)' in line:
+            if line != hline:
+                # new table header: locate the requested columns
+                hline = line
+                header = line.split()
+                if props is None:
+                    props = header[1:] + ['ddE']
+                elif 'ddE' in props and not 'dE(eV)' in props:
+                    props = props + ['dE(eV)']
+                cols = [header.index(prop) if prop in header else -1 for prop in props]
+                if vals is None:
+                    vals = numpy.full((nalloc, nstate, len(props)), numpy.nan)
+
+            line = next(f) # ------
+            line = next(f)
+
+            # store the lines and only parse them if the step is used
+            table = []
+            for istate in range(nstate):
+                if 'Finished' in line: break
+                table.append(line)
+                line = next(f)
+
+        if 'FINISHING STEP' in line:
+            words = line.split()
+            time = float(words[4])
+
+            if tmax is not None and tmax <= time:
+                break
+            elif tmin <= time and len(table) > 0:
+                if nstep == len(times):
+                    times = numpy.concatenate((times, numpy.zeros(nstep)))
+                    act = numpy.concatenate((act, numpy.zeros(nstep, dtype=int)))
+                    vals = numpy.concatenate((vals, numpy.full(vals.shape, numpy.nan)))
+
+                times[nstep] = time
+                act[nstep] = int(words[-1]) - 2
+                labels = [tline.split(None, 1)[0] for tline in table]
+                for istate, tline in enumerate(table):
+                    words = tline.split()
+                    for iprop, col in enumerate(cols):
+                        if col < 1: continue
+                        try:
+                            vals[nstep, istate, iprop] = float(words[col])
+                        except (ValueError, IndexError):
+                            pass
+                nstep += 1
+
+    f.close()
+
+    if vals is None:
+        raise error_handler.MsgError("No TheoDORE output found in %s"%fname)
+
+    vals = vals[:nstep]
+    if 'ddE' in props and 'dE(eV)' in props:
+        dE = vals[:, :, props.index('dE(eV)')]
+        vals[:, :, props.index('ddE')] = dE - dE[:, :1]
+
+    return {'props': props, 'labels': labels, 'times': times[:nstep],
+            'act': act[:nstep], 'vals': vals}
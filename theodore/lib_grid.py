@@ -0,0 +1,681 @@
+"""
+Evaluation of orbitals and densities on a grid.
+The AO basis functions are evaluated once per molecule and grid and stored.
+All orbitals and densities are then obtained as matrix products with the stored AO values.
+"""
+
+from __future__ import print_function, division
+
+from . import error_handler, units, lib_util
+import os, traceback
+import numpy
+from math import factorial
+
+# angular momentum of the shells
+l_dict = {'s':0, 'p':1, 'd':2, 'f':3, 'g':4}
+
+# exponents of the cartesian functions, in the order of the Molden format
+cart_exps = {
+    0: [(0,0,0)],
+    1: [(1,0,0), (0,1,0), (0,0,1)],
+    2: [(2,0,0), (0,2,0), (0,0,2), (1,1,0), (1,0,1), (0,1,1)],
+    3: [(3,0,0), (0,3,0), (0,0,3), (1,2,0), (2,1,0), (2,0,1), (1,0,2), (0,1,2), (0,2,1), (1,1,1)],
+    4: [(4,0,0), (0,4,0), (0,0,4), (3,1,0), (3,0,1), (1,3,0), (0,3,1), (1,0,3), (0,1,3),
+        (2,2,0), (2,0,2), (0,2,2), (2,1,1), (1,2,1), (1,1,2)]
+}
+
+class ao_grid:
+    """
+    AO basis functions evaluated on a set of grid points.
+    The grid is processed in blocks. For every block, only the AOs with values
+      above ao_thresh are stored, either in memory or in a memory-mapped file.
+    """
+    def __init__(self, ao_func, xyz, N, slice_length=1e4, cache_file=None, ao_thresh=0., store=True):
+        """
+        ao_func      - function that returns the AO values (nao x n) at the points x, y, z
+        xyz          - coordinates of the grid points (3 x npts)
+        N            - shape of the grid
+        slice_length - number of grid points that are evaluated at once
+        cache_file   - store the AO values in this memory-mapped .npy file
+        ao_thresh    - neglect AO values below ao_thresh.
+                         In this case, the grid is divided into compact boxes rather than slices.
+        store        - keep the AO values; otherwise they are recomputed for every slice,
+                         so that the memory is bounded by slice_length
+        """
+        self.ao_func = ao_func
+        self.xyz = numpy.asarray(xyz, float)
+        self.N = tuple(int(n) for n in N)
+        self.npts = self.xyz.shape[1]
+        self.slice_length = max(int(slice_length), 1)
+        self.cache_file = cache_file
+        self.ao_thresh = ao_thresh
+        self.store = store
+
+        self.aovals = None # AO values in the cache file (npts x nao)
+        self.aoblocks = None # AO values of the significant AOs for each block
+        self.blocks = None # grid points and significant AOs for each block
+        self.nao = None
+
+    def slices(self):
+        """
+        Iterate over blocks of grid points.
+        Without screening, these are slices of slice_length points.
+        With screening, these are boxes of about slice_length points.
+        """
+        if self.ao_thresh <= 0. or numpy.prod(self.N) != self.npts:
+            for ist in range(0, self.npts, self.slice_length):
+                yield slice(ist, min(ist + self.slice_length, self.npts))
+            return
+
+        nbox = max(int(round(self.slice_length**(1./3.))), 1)
+        for ix in range(0, self.N[0], nbox):
+            for iy in range(0, self.N[1], nbox):
+                for iz in range(0, self.N[2], nbox):
+                    inds = numpy.ix_(numpy.arange(ix, min(ix + nbox, self.N[0])),
+                                     numpy.arange(iy, min(iy + nbox, self.N[1])),
+                                     numpy.arange(iz, min(iz + nbox, self.N[2])))
+                    yield numpy.ravel_multi_index(inds, self.N).flatten()
+
+    def eval_block(self, sl):
+        """
+        Evaluate the AOs on a block of grid points.
+        Returns the values (n x nsig) and the indices of the significant AOs.
+        """
+        x, y, z = self.xyz[:, sl]
+        aos = numpy.asarray(self.ao_func(x, y, z), float).reshape(-1, len(x)).T
+        if self.nao is None:
+            self.nao = aos.shape[1]
+
+        if self.ao_thresh > 0.:
+            cols = numpy.nonzero(numpy.max(abs(aos), 0) >= self.ao_thresh)[0]
+            aos = aos[:, cols]
+        else:
+            cols = numpy.arange(self.nao)
+
+        return aos, cols
+
+    def eval_aos(self, lvprt=1):
+        """
+        Evaluate all AOs on the grid and store them.
+        """
+        self.blocks = []
+        self.aoblocks = []
+        nsig = 0
+        for sl in self.slices():
+            aos, cols = self.eval_block(sl)
+            if self.cache_file is None:
+                self.aoblocks.append(aos)
+            else:
+                if self.aovals is None:
+                    self.aovals = numpy.lib.format.open_memmap(self.cache_file, mode='w+',
+                                                               dtype=float, shape=(self.npts, self.nao))
+                self.aovals[sl] = 0.
+                self.aovals[numpy.ix_(numpy.arange(self.npts)[sl], cols)] = aos
+            self.blocks.append((sl, cols))
+            nsig += len(cols)
+
+        if lvprt >= 1:
+            print("%i AOs evaluated on %i grid points"%(self.nao, self.npts))
+            if self.ao_thresh > 0.:
+                print(" Average number of AOs above %.2e per block: %.1f"%(self.ao_thresh, nsig / len(self.blocks)))
+            if not self.cache_file is None:
+                print(" AO values stored in %s"%self.cache_file)
+
+    def ao_chunks(self):
+        """
+        Iterate over the blocks of grid points.
+        Returns the grid points, the values of the significant AOs, and their indices.
+        """
+        if not self.store:
+            for sl in self.slices():
+                aos, cols = self.eval_block(sl)
+                yield sl, aos, cols
+            return
+
+        if self.blocks is None:
+            self.eval_aos()
+
+        for iblock, (sl, cols) in enumerate(self.blocks):
+            if self.cache_file is None:
+                yield sl, self.aoblocks[iblock], cols
+            else:
+                yield sl, self.aovals[sl][:, cols], cols
+
+    def ret_orbitals(self, C):
+        """
+        Return the orbitals with the AO coefficients C (nao x norb) on the grid.
+        """
+        C = numpy.asarray(C, float)
+        orbs = numpy.zeros((C.shape[1], self.npts))
+        for sl, aos, cols in self.ao_chunks():
+            orbs[:, sl] = numpy.dot(aos, C[cols]).T
+
+        return orbs.reshape((-1,) + self.N)
+
+    def ret_orb_densities(self, C, W):
+        """
+        Return densities as weighted sums over squared orbitals
+            rho_k = sum_i W_ik |phi_i|^2
+        for the orbitals with the AO coefficients C (nao x norb) and the weights W (norb x ndens).
+        The grid is processed in blocks so that only the orbital values of one block are kept.
+        """
+        C = numpy.asarray(C, float)
+        W = numpy.asarray(W, float)
+        rhos = numpy.zeros((W.shape[1], self.npts))
+        for sl, aos, cols in self.ao_chunks():
+            orbs = numpy.dot(aos, C[cols])
+            rhos[:, sl] = numpy.dot(orbs * orbs, W).T
+
+        return rhos.reshape((-1,) + self.N)
+
+    def ret_density(self, D, C=None, thresh=1.e-8):
+        """
+        Return the density
+            rho(r) = sum_ij D_ij phi_i(r) phi_j(r)
+        for the (transition) density matrix D in the basis of the orbitals C (nao x norb)
+          or in the AO basis if C is not given.
+        Only the orbitals with elements |D_ij| >= thresh are considered. The density is
+          evaluated either in the AO basis, as sum_mn phi_m (C D C^T)_mn phi_n,
+          or in the basis of the active orbitals, whichever is cheaper.
+        """
+        D = numpy.array(D, float)
+        D[abs(D) < thresh] = 0.
+        if D.shape[0] != D.shape[1]:
+            # rectangular block, e.g. occ x (occ + virt)
+            Dsq = numpy.zeros((max(D.shape), max(D.shape)))
+            Dsq[:D.shape[0], :D.shape[1]] = D
+            D = Dsq
+        D = 0.5 * (D + D.T)
+
+        if C is None:
+            C = numpy.identity(len(D))
+        C = numpy.asarray(C, float)
+
+        act = numpy.nonzero(numpy.any(D != 0., 1))[0]
+        D = D[numpy.ix_(act, act)]
+        C = C[:, act]
+
+        nao, nact = C.shape
+        if nao * nao <= nact * (nao + nact):
+            D = numpy.dot(numpy.dot(C, D), C.T)
+            C = None
+
+        rho = numpy.zeros(self.npts)
+        for sl, aos, cols in self.ao_chunks():
+            if C is None:
+                rho[sl] = numpy.sum(numpy.dot(aos, D[numpy.ix_(cols, cols)]) * aos, 1)
+            else:
+                vals = numpy.dot(aos, C[cols])
+                rho[sl] = numpy.sum(numpy.dot(vals, D) * vals, 1)
+
+        return rho.reshape(self.N)
+
+    def ret_ao_moments(self, dV, origin=(0., 0., 0.)):
+        """
+        Return the AO overlap, dipole, and second moment matrices, computed by quadrature
+          on the grid with the volume element dV.
+        The result is a (5, nao, nao) array with S, x, y, z, and r^2 relative to origin.
+        """
+        origin = numpy.asarray(origin, float)
+        moms = None
+        for sl, aos, cols in self.ao_chunks():
+            if moms is None:
+                moms = numpy.zeros((5, self.nao, self.nao))
+            r = self.xyz[:, sl] - origin[:, None]
+            ix = numpy.ix_(cols, cols)
+            moms[0][ix] += numpy.dot(aos.T, aos)
+            for k in range(3):
+                moms[k+1][ix] += numpy.dot(aos.T, r[k][:, None] * aos)
+            moms[4][ix] += numpy.dot(aos.T, numpy.sum(r * r, 0)[:, None] * aos)
+
+        return moms * dV
+
+def fact2(n):
+    """
+    Double factorial, with (-1)!! = 1.
+    """
+    return 1 if n <= 0 else n * fact2(n - 2)
+
+def binom(n, k):
+    return factorial(n) // (factorial(k) * factorial(n - k))
+
+def ret_cart_overlap(l):
+    """
+    Angular overlap integrals between the cartesian monomials of degree l,
+      relative to the one of z^l.
+    """
+    exps = cart_exps[l]
+    G = numpy.zeros((len(exps), len(exps)))
+    for i, ei in enumerate(exps):
+        for j, ej in enumerate(exps):
+            e = [ei[k] + ej[k] for k in range(3)]
+            if all(ek % 2 == 0 for ek in e):
+                G[i, j] = fact2(e[0]-1) * fact2(e[1]-1) * fact2(e[2]-1)
+    return G / fact2(2*l-1)
+
+def ret_sph_trans(l):
+    """
+    Transformation matrix from the cartesian monomials x^a y^b z^c (Molden order) to
+      the real solid harmonics in the Molden order m = 0, +1, -1, ..., +l, -l.
+    The solid harmonics are normalized to the norm of z^l.
+    """
+    exps = cart_exps[l]
+    T = numpy.zeros((2*l+1, len(exps)))
+    for m in range(l+1):
+        # (x + iy)^m
+        cmplx = {}
+        for p in range(m+1):
+            cmplx[(m-p, p)] = binom(m, p) * 1j**p
+
+        for k in range((l-m)//2 + 1):
+            # z-dependent part multiplied with r^(2k) = (x^2 + y^2 + z^2)^k
+            pref = (-1)**k * binom(l, k) * binom(2*l-2*k, l) * factorial(l-2*k) // factorial(l-2*k-m)
+            for i in range(k+1):
+                for j in range(k-i+1):
+                    mult = pref * factorial(k) // (factorial(i) * factorial(j) * factorial(k-i-j))
+                    for (a, b), c in cmplx.items():
+                        icart = exps.index((a + 2*i, b + 2*j, l - 2*k - m + 2*(k-i-j)))
+                        if m == 0:
+                            T[0, icart] += mult * c.real
+                        else:
+                            T[2*m-1, icart] += mult * c.real
+                            T[2*m, icart] += mult * c.imag
+
+    G = ret_cart_overlap(l)
+    for ism in range(2*l+1):
+        T[ism] /= numpy.sqrt(numpy.dot(T[ism], numpy.dot(G, T[ism])))
+
+    return T
+
+class gto_basis:
+    """
+    Contracted Gaussian basis set, evaluated on grid points.
+    Each cartesian function is normalized individually, as assumed in the Molden format.
+    With thresh > 0, every shell is only evaluated within its cutoff radius. The points
+      are sorted into buckets so that only the buckets in reach of an atom are visited.
+    """
+    def __init__(self, coor, shells, sph_shells={}, thresh=0., bucket=2.0):
+        """
+        coor       - coordinates of the atoms in bohr (nat x 3)
+        shells     - list of [at_ind, l, [[exp, coeff(s)], ...]], with atom indices starting at 1
+        sph_shells - spherical (True) or cartesian (False) functions for d, f, g
+        thresh     - neglect AO values below thresh
+        bucket     - edge length of the buckets (bohr)
+        """
+        self.coor = numpy.asarray(coor, float)
+        self.thresh = thresh
+        self.bucket = bucket
+        self.shells = [] # (at_ind, l, exps, coeffs, T)
+
+        for at_ind, orbsymb, prims in shells:
+            prims = numpy.array(prims, float)
+            if orbsymb == 'sp':
+                self.add_shell(at_ind - 1, 0, prims[:, 0], prims[:, 1], False)
+                self.add_shell(at_ind - 1, 1, prims[:, 0], prims[:, 2], False)
+            elif orbsymb in l_dict:
+                self.add_shell(at_ind - 1, l_dict[orbsymb], prims[:, 0], prims[:, 1],
+                               sph_shells.get(orbsymb, False))
+            else:
+                raise error_handler.MsgError("Shell type not supported: %s"%orbsymb)
+
+        self.nao = sum(len(shell[4]) for shell in self.shells)
+
+        # cutoff radius for every atom
+        self.at_rcut = numpy.zeros(len(self.coor))
+        for iat, l, alphas, coeffs, T in self.shells:
+            self.at_rcut[iat] = max(self.at_rcut[iat], self.ret_rcut(l, alphas, coeffs, T))
+
+    def add_shell(self, iat, l, alphas, coeffs, sph):
+        """
+        Add a contracted shell, including the normalization into the coefficients.
+        """
+        # primitives normalized for the z^l component
+        coeffs = coeffs * (2. * alphas / numpy.pi)**0.75 * (4. * alphas)**(0.5 * l) / numpy.sqrt(fact2(2*l-1))
+
+        # normalization of the contraction
+        asum = numpy.add.outer(alphas, alphas)
+        S = fact2(2*l-1) / (2. * asum)**l * (numpy.pi / asum)**1.5
+        coeffs = coeffs / numpy.sqrt(numpy.dot(coeffs, numpy.dot(S, coeffs)))
+
+        if sph and l >= 2:
+            T = ret_sph_trans(l)
+        else:
+            T = numpy.diag([numpy.sqrt(fact2(2*l-1) / (fact2(2*a-1) * fact2(2*b-1) * fact2(2*c-1)))
+                            for a, b, c in cart_exps[l]])
+
+        self.shells.append((iat, l, alphas, coeffs, T))
+
+    def ret_rcut(self, l, alphas, coeffs, T, rmax=100., dr=0.05):
+        """
+        Radius beyond which all functions of the shell are below thresh.
+        Uses the bound |x^a y^b z^c| <= r^l.
+        """
+        if self.thresh <= 0.:
+            return numpy.inf
+
+        r = numpy.arange(0., rmax, dr)
+        bound = numpy.max(numpy.sum(abs(T), 1)) * r**l * \
+            numpy.dot(abs(coeffs), numpy.exp(-numpy.outer(alphas, r * r)))
+        above = numpy.nonzero(bound >= self.thresh)[0]
+
+        return rmax if len(above) == 0 else r[above[-1]] + dr
+
+    def ret_aos(self, x, y, z):
+        """
+        Return the values of all AOs at the points x, y, z (nao x npts).
+        """
+        x, y, z = (numpy.asarray(v, float) for v in (x, y, z))
+        aos = numpy.zeros((self.nao, len(x)))
+
+        if self.thresh > 0.:
+            self.set_buckets(numpy.array([x, y, z]))
+
+        iao = 0
+        curr_at = None
+        for iat, l, alphas, coeffs, T in self.shells:
+            if iat != curr_at:
+                curr_at = iat
+                if self.thresh > 0.:
+                    inds = self.ret_bucket_points(self.coor[iat], self.at_rcut[iat])
+                else:
+                    inds = slice(None)
+                d = [x[inds] - self.coor[iat, 0], y[inds] - self.coor[iat, 1], z[inds] - self.coor[iat, 2]]
+                r2 = d[0] * d[0] + d[1] * d[1] + d[2] * d[2]
+                monos = {}
+
+            if not l in monos:
+                pows = [[numpy.ones(len(r2))] for k in range(3)]
+                for k in range(3):
+                    for n in range(l):
+                        pows[k].append(pows[k][-1] * d[k])
+                monos[l] = numpy.array([pows[0][a] * pows[1][b] * pows[2][c] for a, b, c in cart_exps[l]])
+
+            rad = numpy.dot(coeffs, numpy.exp(-numpy.outer(alphas, r2)))
+            aos[iao:iao+len(T), inds] = numpy.dot(T, monos[l]) * rad
+            iao += len(T)
+
+        return aos
+
+    def set_buckets(self, pts):
+        """
+        Sort the points (3 x npts) into cubic buckets.
+        """
+        pmin = numpy.min(pts, 1)
+        ibs = numpy.floor((pts - pmin[:, None]) / self.bucket).astype(int)
+        nb = numpy.max(ibs, 1) + 1
+        keys = (ibs[0] * nb[1] + ibs[1]) * nb[2] + ibs[2]
+
+        self.border = numpy.argsort(keys, kind='stable')
+        ukeys, self.bstart = numpy.unique(keys[self.border], return_index=True)
+        self.bend = numpy.append(self.bstart[1:], len(keys))
+        bind = numpy.array([ukeys // (nb[1] * nb[2]), (ukeys // nb[2]) % nb[1], ukeys % nb[2]])
+        self.blo = pmin[:, None] + bind * self.bucket
+        self.bhi = self.blo + self.bucket
+
+    def ret_bucket_points(self, cent, rcut):
+        """
+        Return the indices of the points in all buckets within rcut of cent.
+        """
+        dist = numpy.maximum(0., numpy.maximum(self.blo - cent[:, None], cent[:, None] - self.bhi))
+        sel = numpy.nonzero(numpy.sum(dist * dist, 0) < rcut * rcut)[0]
+
+        lens = self.bend[sel] - self.bstart[sel]
+        offs = numpy.repeat(self.bstart[sel] - numpy.cumsum(lens) + lens, lens)
+        return self.border[offs + numpy.arange(numpy.sum(lens))]
+
+class grid_plot:
+    """
+    Orbitals and densities on a rectangular grid, written as cube files.
+    The AOs are evaluated with the built-in GTO code.
+    """
+    def __init__(self, ao_cache=None, ao_thresh=0., ao_store=True, extend=5.0, step=0.4, resume=False,
+                 binary=False, dtype='float32'):
+        self.slice_length = 1e4
+        self.ao_cache = ao_cache   # file for memory-mapping the AO values
+        self.ao_thresh = ao_thresh # threshold for screening AOs on the grid
+        self.ao_store = ao_store   # keep the AO values or recompute them for every slice
+        self.extend = extend       # distance of the grid boundaries from the atoms (bohr)
+        self.step = step           # grid spacing (bohr)
+        self.resume = resume       # skip cube files that already exist
+        self.binary = binary       # write compressed binary cube files
+        self.dtype = dtype         # data type of the values in binary cube files
+        self.cube_ext = lib_util.binary_ext if binary else '.cb'
+
+        # The grid and the AO values are kept for all calls with the same MOs
+        self.mos = None
+        self.aogrid = None
+
+    def prep_grid(self, mos):
+        """
+        Initialize the grid and evaluate the AOs on it.
+        This is only done once for a given set of MOs.
+        """
+        if self.mos is mos:
+            return
+
+        if len(mos.gto_shells) == 0 or len(mos.at_dicts) == 0:
+            raise error_handler.MsgError('No basis set information available for the grid evaluation.\n\
+            Use an MO file in Molden format.')
+
+        self.Zs = [at['Z'] for at in mos.at_dicts]
+        self.coor = numpy.array([[at['x'], at['y'], at['z']] for at in mos.at_dicts]) / units.length['A']
+        basis = gto_basis(self.coor, mos.gto_shells, mos.sph_shells, thresh=self.ao_thresh)
+        if basis.nao != mos.ret_num_bas():
+            raise error_handler.MsgError('Inconsistent number of basis functions: %i/%i'%(basis.nao, mos.ret_num_bas()))
+
+        # Rectangular grid around the molecule
+        cmin = numpy.min(self.coor, 0) - self.extend
+        cmax = numpy.max(self.coor, 0) + self.extend
+        self.origin = cmin
+        self.N = [int(numpy.ceil((cmax[k] - cmin[k]) / self.step)) + 1 for k in range(3)]
+        axes = [cmin[k] + self.step * numpy.arange(self.N[k]) for k in range(3)]
+        self.slice_length = self.N[1] * self.N[2] / 2
+
+        xyz = numpy.array([xyz.flatten() for xyz in numpy.meshgrid(*axes, indexing='ij')])
+        self.aogrid = ao_grid(basis.ret_aos, xyz, self.N, slice_length=self.slice_length,
+                              cache_file=self.ao_cache, ao_thresh=self.ao_thresh, store=self.ao_store)
+        if self.ao_store:
+            print("Evaluating the AOs on the grid ...")
+            self.aogrid.eval_aos()
+
+        self.mos = mos
+
+    def ret_ao_moments(self, mos):
+        """
+        Return the AO overlap, dipole, and r^2 matrices (bohr), computed by quadrature
+          on the grid relative to the center of the atoms.
+        """
+        self.prep_grid(mos)
+        return self.aogrid.ret_ao_moments(self.step**3, numpy.mean(self.coor, 0))
+
+    def ret_NTO_coeffs(self, U, lam, Vt, mos, minlam=1e-3):
+        """
+        Return the AO coefficients (nao x norb), the signed NTO weights, and labels of
+          the hole and particle NTOs with weights above minlam.
+        """
+        UV_t = numpy.vstack((mos.CdotD(U).T[::-1], mos.MdotC(Vt)))
+        lam2 = numpy.hstack((-lam[::-1], lam, numpy.zeros(len(Vt) - len(lam))))
+        sel = numpy.nonzero(abs(lam2) > minlam)[0]
+        syms = ['NTO_h' if i < len(lam) else 'NTO_p' for i in sel]
+
+        return UV_t[sel].T, lam2[sel], syms
+
+    def cubes_exist(self, cube_ids):
+        """
+        Check if all cube files exist and can be skipped.
+        """
+        if self.resume and all(os.path.exists(fid + self.cube_ext) for fid in cube_ids):
+            print("Skipping existing cube files: %s"%', '.join(cube_ids))
+            return True
+        return False
+
+    def run_jobs(self, jobs, mos, numproc=1):
+        """
+        Run a list of cube file jobs. Every job is a tuple
+          (label, method name, args, kwargs)
+          and the method returns the list of cube ids written.
+        For numproc > 1, the jobs are distributed over worker processes, which share
+          the AO values evaluated by the parent process (or the AO cache file).
+        A failing job is reported but does not stop the others.
+        Returns the cube ids of all successful jobs and the labels of the failed jobs.
+        """
+        global _plot_jobs
+        if numproc > 1 and len(jobs) > 1:
+            import multiprocessing
+            try:
+                ctx = multiprocessing.get_context('fork')
+            except ValueError:
+                print("Process forking not available, running cube file jobs serially.")
+                numproc = 1
+
+        if numproc > 1 and len(jobs) > 1:
+            print("Distributing %i cube file jobs over %i processes ..."%(len(jobs), numproc))
+            self.prep_grid(mos)
+            _plot_jobs = (self, jobs)
+            try:
+                with ctx.Pool(numproc) as pool:
+                    results = pool.map(_run_plot_job, range(len(jobs)), chunksize=1)
+            finally:
+                _plot_jobs = None
+        else:
+            _plot_jobs = (self, jobs)
+            try:
+                results = [_run_plot_job(ijob) for ijob in range(len(jobs))]
+            finally:
+                _plot_jobs = None
+
+        cube_ids = []
+        failed = []
+        for job, (ids, err) in zip(jobs, results):
+            if err is None:
+                cube_ids += ids
+            else:
+                print(" *** Cube file job %s failed:\n%s"%(job[0], err))
+                failed.append(job[0])
+
+        if len(failed) > 0:
+            print("\n %i of %i cube file jobs failed: %s"%(len(failed), len(jobs), ', '.join(failed)))
+
+        return cube_ids, failed
+
+    def compute_p_h_dens(self, state, U, lam, Vt, mos, minlam=1e-3, numproc=4, pref='', post=''):
+        lab = state['name'].replace('(', '-').replace(')', '-') + post
+        cube_ids = ['%srho_p_%s'%(pref, lab), '%srho_h_%s'%(pref, lab)]
+        if self.cubes_exist(cube_ids):
+            return cube_ids
+        print(("Calculating particle/hole density for %s" % lab))
+
+        self.prep_grid(mos)
+        C, lam2, syms = self.ret_NTO_coeffs(U, lam, Vt, mos, minlam=minlam)
+
+        # Calculate hole and particle density
+        #   slice by slice, without storing the NTOs on the whole grid
+        W = numpy.zeros((len(lam2), 2))
+        for i, sym in enumerate(syms):
+            if 'p' in sym:
+                W[i, 0] = abs(lam2[i])
+            else:
+                W[i, 1] = -abs(lam2[i])
+        rho_p, rho_h = self.aogrid.ret_orb_densities(C, W)
+
+        self.write_cube(rho_p, cube_ids[0])
+        self.write_cube(rho_h, cube_ids[1])
+
+        return cube_ids
+
+    def compute_rho_0_n(self, state_list, mos, numproc=4):
+        self.prep_grid(mos)
+        C = mos.ret_mo_mat()
+
+        cube_fids = []
+        for state in state_list:
+            print(("Transition density between ground state and excited state %s" % (state['name'])))
+            rho0n = self.aogrid.ret_density(state['tden'], C)
+            fid = 'rho_0_%s' % (state['name'].replace('(', '-').replace(')', '-'))
+            self.write_cube(rho0n, fid)
+            cube_fids.append(fid)
+
+        return cube_fids
+
+    def compute_rho(self, state_list, mos, numproc=4):
+        """
+        Compute the density of the states.
+        Also compute unpaired densities if they are available.
+        """
+        print("Preparing density evaluations on a grid ...")
+        self.prep_grid(mos)
+        C = mos.ret_mo_mat()
+
+        cube_fids = []
+        for state in state_list:
+            print("Computing densities for state %s" % (state['name']))
+            for dtyp in ['sden', 'nu_den', 'nunl_den']:
+                if not dtyp in state:
+                    continue
+                rho = self.aogrid.ret_density(state[dtyp], C)
+                fid = '%s_%s' % (dtyp, state['name'].replace('(', '-').replace(')', '-'))
+                self.write_cube(rho, fid)
+                cube_fids.append(fid)
+
+        return cube_fids
+
+    def cube_file_creator(self, state, U, lam, Vt, mos, minlam=1e-3, numproc=4):
+        C, lam2, syms = self.ret_NTO_coeffs(U, lam, Vt, mos, minlam=minlam)
+        cube_ids = ['%s_%s_%.2f'% (syms[i], state['name'].replace('(', '-').replace(')', '-'), abs(lam2[i]))
+                    for i in range(len(lam2))]
+        if self.cubes_exist(cube_ids):
+            return cube_ids
+        print(("Calculating NTOs as cube files for state %s" % (state['name'])))
+
+        self.prep_grid(mos)
+        molist = self.aogrid.ret_orbitals(C)
+
+        for i in range(len(molist)):
+            self.write_cube(molist[i], cube_ids[i])
+        return cube_ids
+
+    def write_cube(self, vals, fid):
+        """
+        Write the values on the grid to the cube file <fid>.cb or <fid>.cbz
+        """
+        header = ' %s\n Generated by TheoDORE\n'%fid
+        header += '%5i %12.6f %12.6f %12.6f\n'%(len(self.Zs), self.origin[0], self.origin[1], self.origin[2])
+        for k in range(3):
+            vec = [0., 0., 0.]
+            vec[k] = self.step
+            header += '%5i %12.6f %12.6f %12.6f\n'%(self.N[k], vec[0], vec[1], vec[2])
+        for Z, xyz in zip(self.Zs, self.coor):
+            header += '%5i %12.6f %12.6f %12.6f %12.6f\n'%(Z, Z, xyz[0], xyz[1], xyz[2])
+
+        cube = lib_util.cube_file(fid + self.cube_ext, header, numpy.ravel(vals), self.N[2])
+        cube.write(dtype=self.dtype)
+
+    def vmd_network_creator(self, filename='', cube_ids=[], isovalue=0.01):
+        """
+        Write a VMD script that loads all cube files with isosurfaces at +/- isovalue.
+        """
+        with open('%s.vmd'%filename, 'w') as f:
+            for icube, cube_id in enumerate(cube_ids):
+                f.write('mol new %s.cb type cube\n'%cube_id)
+                f.write('mol delrep 0 %i\n'%icube)
+                for iso, col in [(isovalue, 0), (-isovalue, 1)]:
+                    f.write('mol representation Isosurface %.5f 0 0 0 1 1\n'%iso)
+                    f.write('mol color ColorID %i\n'%col)
+                    f.write('mol addrep %i\n'%icube)
+        print("File %s written."%f.name)
+        if self.binary:
+            print("Convert the binary cube files for VMD using: theodore cube_convert *%s"%self.cube_ext)
+
+# grid_plot instance and job list of run_jobs, inherited by the worker processes
+_plot_jobs = None
+
+def _run_plot_job(ijob):
+    """
+    Run one cube file job, returning (cube ids, None) or (None, error message).
+    """
+    plot, jobs = _plot_jobs
+    label, meth, args, kwargs = jobs[ijob]
+    try:
+        return getattr(plot, meth)(*args, **kwargs), None
+    except Exception:
+        return None, traceback.format_exc()
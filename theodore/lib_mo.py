@@ -19,6 +19,8 @@ class MO_set:
         self.basis_fcts = [] # info about basis functions
         self.bf_labels = [] # list of basis function labels
         self.at_dicts = [] # info about atoms: {'Z':, 'x':, 'y':, 'z':}
+        self.gto_shells = [] # contracted shells: [at_ind, l, [[exp, coeff(s)], ...]]
+        self.sph_shells = {} # spherical (True) or cartesian (False) functions for d, f, g
 
         self.S = None
         self.mo_mat = None
@@ -292,24 +294,32 @@ class MO_set:
 
         return numpy.dot(self.Sinv2, numpy.dot(D, self.Sinv2))
 
-    def export_MO(self, ens, occs, U, *args, **kwargs):
+    def export_MO(self, ens, occs, U, *args, occmin=-1, **kwargs):
         """
         Exports NO, NDO etc. coefficients given in the MO basis.
+        Orbitals with |occ| < occmin are removed before the AO transformation.
         """
-        mo_mat = self.CdotD(U, trnsp=False, inv=False)
+        sel = numpy.nonzero(~(abs(numpy.asarray(occs)) < occmin))[0]
+        mo_mat = self.CdotD(U[:, sel], trnsp=False, inv=False)
 
-        self.export_AO(ens, occs, mo_mat.transpose(), *args, **kwargs)
+        self.export_AO(numpy.asarray(ens)[sel], numpy.asarray(occs)[sel], mo_mat.transpose(), *args, **kwargs)
 
-    def export_NTO(self, lam, U, Vt, *args, **kwargs):
+    def export_NTO(self, lam, U, Vt, *args, occmin=-1, **kwargs):
         """
         Exports NTO coefficients given in the MO basis.
+        The hole NTOs are written in reverse order with negative weights.
+        NTOs with lam < occmin are removed before the AO transformation.
         """
-        U_mat_t = self.CdotD(U,  trnsp=False, inv=False).transpose()
-        V_mat_t = self.MdotC(Vt, trnsp=True,  inv=False)
+        lam = numpy.asarray(lam)
+        lamV = numpy.hstack((lam, numpy.zeros(len(Vt) - len(lam))))
+        hsel = numpy.nonzero(~(lam < occmin))[0][::-1]
+        psel = numpy.nonzero(~(lamV < occmin))[0]
 
-        UV_t = [iU for iU in reversed(U_mat_t)] + [iV for iV in V_mat_t]
+        U_mat_t = self.CdotD(U[:, hsel], trnsp=False, inv=False).transpose()
+        V_mat_t = self.MdotC(Vt[psel], trnsp=True,  inv=False)
 
-        lam2 = [-vlam for vlam in reversed(lam)] + [vlam for vlam in lam] + [0.] * (len(Vt) - len(lam))
+        UV_t = numpy.vstack((U_mat_t, V_mat_t))
+        lam2 = numpy.hstack((-lam[hsel], lamV[psel]))
 
         self.export_AO(lam2, lam2, UV_t, *args, **kwargs)
 
@@ -387,6 +397,7 @@ class MO_set_molden(MO_set):
         Export coefficients given already in the AO basis to molden file.
 
         Ct can either be a list or numpy array with the coefficients.
+        The coefficients of every orbital are formatted as one block.
         """
         mld = open(fname, 'w')
         mld.write(self.header)
@@ -407,14 +418,12 @@ class MO_set_molden(MO_set):
             else:
                 mld.write(' Spin= Alpha\n')
                 mld.write(' Occup= %f\n'%occs[imo])
-            for ibf, coeff in enumerate(Ct[imo]):
-                fmtstr = '%10i   '+cfmt+'\n'
-                mld.write(fmtstr%(ibf+1, coeff))
+            mld.write(ret_coeff_block(Ct[imo], '%10i   ', cfmt))
 
         mld.close()
 
     def ret_coeffs(self, occmin=-1., occmax=100., eneocc=False, sym='X'):
-        outstr = ''
+        outstrs = []
 
         for imo in range(self.ret_num_mo()):
             if eneocc:
@@ -424,14 +433,13 @@ class MO_set_molden(MO_set):
             if abs(occ) < occmin: continue
             if abs(occ) > occmax: continue
 
-            outstr += ' Sym= %s\n'%sym
-            outstr += ' Ene= %f\n'%self.ens[imo]
-            outstr += ' Spin= Alpha\n'
-            outstr += ' Occup= %f\n'%occ
-            for ibf, coeff in enumerate(self.mo_mat[:,imo]):
-                outstr += '%10i  % 10E\n'%(ibf+1, coeff)
+            outstrs.append(' Sym= %s\n'%sym)
+            outstrs.append(' Ene= %f\n'%self.ens[imo])
+            outstrs.append(' Spin= Alpha\n')
+            outstrs.append(' Occup= %f\n'%occ)
+            outstrs.append(ret_coeff_block(self.mo_mat[:,imo], '%10i  ', '% 10E'))
 
-        return outstr
+        return ''.join(outstrs)
 
     def read(self, lvprt=1, spin=0):
         """
@@ -476,6 +484,7 @@ class MO_set_molden(MO_set):
         if ('9G]' in fstr) or ('9G]' in fstr):
             num_bas['g']=9
             orient['g']=9*['?']
+        self.sph_shells = {'d':num_bas['d']==5, 'f':num_bas['f']==7, 'g':num_bas['g']==9}
 
         fileh.seek(0) # rewind the file
 
@@ -557,6 +566,7 @@ class MO_set_molden(MO_set):
                     self.num_at = max(curr_at, self.num_at)
                 elif (len(words) >= 2) and (words[0].lower() in num_bas):
                   orbsymb = words[0].lower()
+                  self.gto_shells.append([curr_at, orbsymb, []])
 
                   for i in range(num_bas[orbsymb]):
                     self.basis_fcts.append(basis_fct(curr_at, orbsymb, orient[orbsymb][i]))
@@ -565,6 +575,14 @@ class MO_set_molden(MO_set):
                         self.bf_labels.append(label)
 
                     num_orb+=1
+                elif len(self.gto_shells) > 0:
+                    # exponent and contraction coefficient(s) of a primitive
+                    try:
+                        prim = [float(word.replace('D', 'E').replace('d', 'e')) for word in words]
+                    except ValueError:
+                        pass
+                    else:
+                        self.gto_shells[-1][2].append(prim)
 
             elif '[atoms]' in line.lower():
                 ATOMS = True
@@ -1033,3 +1051,18 @@ class jmol_MOs:
 
         print("\nJmol input file %s and %s written"%(self.jmfile.name, self.htmlfile.name))
         print("   Run as: jmol -n %s"%self.jmfile.name)
+
+def ret_coeff_block(coeffs, ind_fmt, cfmt):
+    """
+    Format the coefficients of one orbital as lines ind_fmt%ibf + cfmt,
+      with basis function indices ibf starting at 1.
+    The basis function indices are written into the format string, which is
+      reused for all orbitals of the same size.
+    """
+    key = (len(coeffs), ind_fmt, cfmt)
+    if not key in _coeff_fmts:
+        _coeff_fmts[key] = ''.join((ind_fmt%(ibf+1)).replace('%', '%%') + cfmt + '\n'
+                                   for ibf in range(len(coeffs)))
+    return _coeff_fmts[key] % tuple(numpy.asarray(coeffs, float).tolist())
+
+_coeff_fmts = {}
@@ -71,6 +71,13 @@ class write_plot_options(input_options.write_options):
 
         #print self.data
 
+    def ret_val(self, idir, state, key):
+        """
+        Return the value of property key for state in directory idir.
+        Raises KeyError if the value is not available.
+        """
+        return self.data[idir][state][key]
+
     def plot(self):
         """
         Create the plots.
@@ -108,7 +115,7 @@ class write_plot_options(input_options.write_options):
                 ylist = []
                 for iana_dir in range(len(self['ana_dirs'])):
                     try:
-                        ylist.append(self.data[iana_dir][state][key])
+                        ylist.append(self.ret_val(iana_dir, state, key))
                     except KeyError:
                         print(" ... not able to plot %s for %s."%(key, state))
                         break
@@ -164,7 +171,7 @@ class write_plot_options(input_options.write_options):
 
                 for state in self['state_labels']:
                     try:
-                        wf.write('%10.5f'%self.data[idir][state][key])
+                        wf.write('%10.5f'%self.ret_val(idir, state, key))
                         found_data = True
                     except KeyError:
                         #wf.write('    -     ')
@@ -238,7 +238,7 @@ class sden_ana(dens_ana_base.dens_ana_base):
         if len(self.state_list) == 0: return
         if not 'sden' in self.state_list[0]: return
 
-        lib_orbkit = orbkit_interface.lib_orbkit()
+        lib_orbkit = self.ret_lib_orbkit()
         cube_ids = lib_orbkit.compute_rho(self.state_list,self.mos,numproc=self.ioptions['numproc'])
 
     def compute_a_d_dens(self):
@@ -137,9 +137,9 @@ class tden_ana_soc(lib_tden.tden_ana):
             self.compute_all_OmFrag()
             if self.ioptions['print_OmFrag']:
                 self.fprint_OmFrag('%s_OmFrag.txt'%pre)
-        if 'RMSeh' in self.ioptions.get('prop_list') or 'MAeh' in self.ioptions.get('prop_list') or 'Eb' in self.ioptions.get('prop_list'):
+        if any(prop in self.ioptions.get('prop_list') for prop in lib_exciton.exciton_props):
             exca = lib_exciton.exciton_analysis()
-            exca.get_distance_matrix(self.struc)
+            exca.get_distance_matrix(self.struc, self.ioptions['Eb_diag'])
             self.analyze_excitons(exca)
         self.print_all_eh_pop()
         self.print_summary()
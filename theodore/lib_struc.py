@@ -5,7 +5,7 @@ This is a wrapper to python-openbabel.
 
 from __future__ import print_function, division
 
-import os, shutil, locale
+import os, shutil, locale, itertools
 import numpy
 obabel_avail = True
 try:
@@ -16,7 +16,7 @@ except ImportError:
     print(" Using emulation program with limited capabilities ...")
     from . import OB_repl as openbabel
 from . import units, error_handler
-from .atominfo import symbol_Z_dict, Z_symbol_dict
+from .atominfo import symbol_Z_dict, Z_symbol_dict, Z_covrad_dict
 
 veloc_types = ['vtxyz','vnx'] # these are defined below
 
@@ -28,6 +28,12 @@ class structure:
         self.name = name
         self.new_types = ['txyz2', 'Bqxyz','col','colr','nx'] # these are defined here
 
+        # Cached geometry information, see update_cache()
+        self.cache_mol = None
+        self.coor = None    # (num_at, 3) coordinates in Angstrom
+        self.at_nums = None # atomic numbers
+        self.masses = None  # exact masses, only constructed when needed
+
     def read_file(self, file_path, file_type=None):
         """
         Read in the structure from a file.
@@ -35,6 +41,7 @@ class structure:
         self.file_path = file_path
         self.file_type = file_type if file_type != None else self.guess_file_type(file_path)
         self.mol = openbabel.OBMol()
+        self.clear_cache()
 
         if self.file_type in self.new_types:
             self.read_new_type()
@@ -128,6 +135,7 @@ class structure:
         self.file_path = file_path
         self.file_type = file_type
         self.mol = mol
+        self.clear_cache()
 
     def read_file_vector(self, def_file_path, file_type, vector):
         """
@@ -138,6 +146,7 @@ class structure:
         for i in range(self.mol.NumAtoms()):
             atom = self.mol.GetAtom(i+1)
             atom.SetVector(vector[3*i], vector[3*i+1], vector[3*i+2])
+        self.clear_cache()
         #print 'read_file_vector done'
 
     def read_file_3xN_matrix(self, def_file_path, file_type, coor_mat):
@@ -164,6 +173,7 @@ class structure:
         for imat,iat in enumerate(at_list):
             atom = self.mol.GetAtom(iat)
             atom.SetVector(coor_mat[imat][0], coor_mat[imat][1], coor_mat[imat][2])
+        self.clear_cache()
 
     def read_at_dicts(self, at_dicts):
         """
@@ -171,6 +181,7 @@ class structure:
         [{'Z':, 'x':, 'y':, 'z':}, ...]
         """
         self.mol = openbabel.OBMol()
+        self.clear_cache()
 
         for iat in range(len(at_dicts)):
             obatom = openbabel.OBAtom()
@@ -180,30 +191,92 @@ class structure:
 
             self.mol.AddAtom(obatom)
 
-    def ret_vector(self):
-        " All the coordinates in one vector "
-        vec_list = []
-        for i in range(self.mol.NumAtoms()):
+    def clear_cache(self):
+        """
+        Invalidate the cached geometry information.
+        This has to be called whenever the coordinates of self.mol are changed.
+        """
+        self.cache_mol = None
+        self.coor = None
+        self.at_nums = None
+        self.masses = None
+
+    def update_cache(self):
+        """
+        Walk through the atoms once and store coordinates and atomic numbers
+          as contiguous arrays.
+        """
+        if self.cache_mol is self.mol and not self.coor is None:
+            return
+
+        num_at = self.mol.NumAtoms()
+        self.coor = numpy.zeros([num_at, 3])
+        self.at_nums = numpy.zeros(num_at, int)
+        for i in range(num_at):
             atom = self.mol.GetAtom(i+1)
-            vec_list += [atom.x(), atom.y(), atom.z()]
+            self.coor[i] = atom.x(), atom.y(), atom.z()
+            # undefined atomic numbers are stored as 0
+            self.at_nums[i] = atom.GetAtomicNum() or 0
+
+        self.masses = None
+        self.cache_mol = self.mol
 
-        return numpy.array(vec_list)
+    def ret_coor(self):
+        """
+        Return the cached (num_at, 3) coordinate array (Angstrom).
+        The array is shared - use ret_3xN_matrix() for a copy.
+        """
+        self.update_cache()
+        return self.coor
+
+    def ret_at_nums(self):
+        """
+        Return the cached vector of atomic numbers.
+        """
+        self.update_cache()
+        return self.at_nums
+
+    def ret_masses(self, at_list=None):
+        """
+        Return the cached vector of exact masses.
+        If <at_list> is specified, only the masses of those atoms are returned.
+          They are looked up individually unless all masses are already cached.
+        """
+        self.update_cache()
+        if at_list is not None:
+            inds = self.ret_at_inds(at_list)
+            if self.masses is not None:
+                return self.masses[inds]
+            return numpy.array([self.mol.GetAtom(int(i)+1).GetExactMass() for i in inds], float)
+
+        if self.masses is None:
+            self.masses = numpy.array([self.mol.GetAtom(i+1).GetExactMass()
+                for i in range(len(self.at_nums))], float)
+        return self.masses
+
+    def ret_at_inds(self, at_list):
+        """
+        Convert the atom indices in <at_list> (starting at 1) into array indices.
+        """
+        inds = numpy.array(at_list, int).reshape(-1) - 1
+        num_at = len(self.ret_coor())
+        if len(inds) > 0 and (inds.min() < 0 or inds.max() >= num_at):
+            raise error_handler.MsgError("Atom indices must be between 1 and %i: %s"%(num_at, str(list(at_list))))
+        return inds
+
+    def ret_vector(self):
+        " All the coordinates in one vector "
+        return self.ret_coor().flatten()
 
     def ret_3xN_matrix(self, at_list=None):
         """
         Return coordinates in a 3 x N matrix.
         If <at_list> is specified only the atoms with those indices are considered.
         """
-        mat_list = []
-
         if at_list == None:
-            at_list = [i+1 for i in range(self.mol.NumAtoms())]
-
-        for i in at_list:
-            atom = self.mol.GetAtom(i)
-            mat_list += [[atom.x(), atom.y(), atom.z()]]
-
-        return numpy.array(mat_list)
+            return self.ret_coor().copy()
+        else:
+            return self.ret_coor()[self.ret_at_inds(at_list)]
 
     def ret_center_of_mass(self, at_list=None, masswt=1):
         """
@@ -211,21 +284,15 @@ class structure:
         masswt - power of the mass used for mass-weighting
         at_list - fragment definition
         """
-        if at_list == None:
-            at_list = [i+1 for i in range(self.mol.NumAtoms())]
-
-        tmass = 0.
-        xyz = numpy.zeros(3, float)
-        for i in at_list:
-            atom = self.mol.GetAtom(i)
-            if masswt == 0:
-                mass = 1
-            else:
-                mass = atom.GetExactMass()**masswt
-            tmass += mass
-            xyz += mass * numpy.array([atom.x(), atom.y(), atom.z()])
+        coor = self.ret_3xN_matrix(at_list)
+        if masswt == 0:
+            mass = numpy.ones(len(coor))
+        elif at_list == None:
+            mass = self.ret_masses()**masswt
+        else:
+            mass = self.ret_masses(at_list)**masswt
 
-        return xyz / tmass
+        return numpy.dot(mass, coor) / numpy.sum(mass)
 
     def ret_normal_vector(self, at_list):
         """
@@ -234,12 +301,7 @@ class structure:
         """
         assert(len(at_list)==3)
 
-        atom = self.mol.GetAtom(at_list[0])
-        xyz1  = numpy.array([atom.x(), atom.y(), atom.z()])
-        atom = self.mol.GetAtom(at_list[1])
-        xyz2  = numpy.array([atom.x(), atom.y(), atom.z()])
-        atom = self.mol.GetAtom(at_list[2])
-        xyz3  = numpy.array([atom.x(), atom.y(), atom.z()])
+        xyz1, xyz2, xyz3 = self.ret_3xN_matrix(at_list)
 
         vec = numpy.cross(xyz2-xyz1, xyz3-xyz1)
         return vec / numpy.linalg.norm(vec)
@@ -261,43 +323,33 @@ class structure:
         """
         Return the distance between atoms indexed i and j.
         """
+        coor = self.ret_coor()
+        vec = coor[i-1] - coor[j-1]
 
-        OBAtom_i = self.mol.GetAtom(i)
-        OBAtom_j = self.mol.GetAtom(j)
-
-        pos_i = numpy.array([OBAtom_i.x(), OBAtom_i.y(), OBAtom_i.z()])
-        pos_j = numpy.array([OBAtom_j.x(), OBAtom_j.y(), OBAtom_j.z()])
-
-        return numpy.dot(pos_i - pos_j, pos_i - pos_j)**.5
+        return numpy.dot(vec, vec)**.5
 
     def ret_distance_matrix(self):
         """
         Return a matrix containing all the distances between atoms.
+        The squared distances are accumulated one Cartesian component at a time
+          to keep the temporary memory at num_at x num_at.
         """
-        num_at = self.mol.NumAtoms()
+        coor = self.ret_coor()
+        num_at = len(coor)
 
         ret_mat = numpy.zeros([num_at, num_at])
+        for k in range(3):
+            diff = numpy.subtract.outer(coor[:,k], coor[:,k])
+            diff *= diff
+            ret_mat += diff
 
-        for iat in range(num_at):
-            for jat in range(iat+1, num_at):
-                bij = self.ret_bond_length(iat+1, jat+1)
-                ret_mat[iat, jat] = bij
-                ret_mat[jat, iat] = bij
-
-        return ret_mat
+        return numpy.sqrt(ret_mat, out=ret_mat)
 
     def ret_bend(self, i, j, k):
         """
         Return the bending angle between atoms indexed i, j, k.
         """
-
-        OBAtom_i = self.mol.GetAtom(i)
-        OBAtom_j = self.mol.GetAtom(j)
-        OBAtom_k = self.mol.GetAtom(k)
-
-        pos_i = numpy.array([OBAtom_i.x(), OBAtom_i.y(), OBAtom_i.z()])
-        pos_j = numpy.array([OBAtom_j.x(), OBAtom_j.y(), OBAtom_j.z()])
-        pos_k = numpy.array([OBAtom_k.x(), OBAtom_k.y(), OBAtom_k.z()])
+        pos_i, pos_j, pos_k = self.ret_3xN_matrix([i, j, k])
 
         vec1 = pos_i - pos_j
         vec2 = pos_k - pos_j
@@ -312,16 +364,7 @@ class structure:
         Return the torsion angle between atoms indexed i, j, k, l.
         """
         # Dihedral angle computed according to (http://en.wikipedia.org/wiki/Dihedral_angle) to get the full 360 deg range.
-
-        OBAtom_i = self.mol.GetAtom(i)
-        OBAtom_j = self.mol.GetAtom(j)
-        OBAtom_k = self.mol.GetAtom(k)
-        OBAtom_l = self.mol.GetAtom(l)
-
-        pos_i = numpy.array([OBAtom_i.x(), OBAtom_i.y(), OBAtom_i.z()])
-        pos_j = numpy.array([OBAtom_j.x(), OBAtom_j.y(), OBAtom_j.z()])
-        pos_k = numpy.array([OBAtom_k.x(), OBAtom_k.y(), OBAtom_k.z()])
-        pos_l = numpy.array([OBAtom_l.x(), OBAtom_l.y(), OBAtom_l.z()])
+        pos_i, pos_j, pos_k, pos_l = self.ret_3xN_matrix([i, j, k, l])
 
         vec1 = pos_j - pos_i
         vec2 = pos_k - pos_j
@@ -341,7 +384,7 @@ class structure:
         Returns the symbol of atom i.
         """
         try:
-            return Z_symbol_dict[self.mol.GetAtom(i).GetAtomicNum()]
+            return Z_symbol_dict[self.ret_at_nums()[i-1]]
         except KeyError:
             return 'X'
 
@@ -355,12 +398,55 @@ class structure:
         """
         Returns a vector with the masses of the atoms (each repeated <rep> times) taken to the <power> power.
         """
-        mass_list = []
-        for i in range(self.mol.NumAtoms()):
-            atom = self.mol.GetAtom(i+1)
-            mass_list += rep * [atom.GetExactMass()**power]
+        return numpy.repeat(self.ret_masses()**power, rep)
 
-        return numpy.array(mass_list, float)
+    def ret_bonds(self, tol=0.45, min_dist=0.4):
+        """
+        Return the bonds as an (nbond, 2) array of atom indices (starting with 1).
+        Two atoms are bonded if their distance is smaller than the sum of their
+          covalent radii plus <tol> (Angstrom), analogous to openbabel.
+        The neighbour search uses a cell list so that the cost is linear in the
+          number of atoms.
+        """
+        coor = self.ret_coor()
+        num_at = len(coor)
+        if num_at < 2:
+            return numpy.zeros([0, 2], int)
+
+        rad = numpy.array([Z_covrad_dict.get(Z, 1.5) for Z in self.ret_at_nums()])
+
+        # Assign the atoms to cubic cells of the maximal bond length
+        #   with one layer of empty cells as margin.
+        clen = 2 * rad.max() + tol
+        icell = numpy.floor((coor - coor.min(0)) / clen).astype(int) + 1
+        ncell = icell.max(0) + 2
+        key = numpy.ravel_multi_index(icell.T, ncell)
+        order = numpy.argsort(key, kind='stable')
+        skey = key[order]
+
+        bonds = []
+        for off in itertools.product([-1, 0, 1], repeat=3):
+            nkey = numpy.ravel_multi_index((icell + off).T, ncell)
+            start = numpy.searchsorted(skey, nkey, 'left')
+            counts = numpy.searchsorted(skey, nkey, 'right') - start
+
+            # all pairs of an atom with the atoms in the neighbouring cell
+            iat = numpy.repeat(numpy.arange(num_at), counts)
+            jpos = numpy.arange(len(iat)) - numpy.repeat(numpy.cumsum(counts) - counts - start, counts)
+            jat = order[jpos]
+
+            sel = iat < jat
+            iat, jat = iat[sel], jat[sel]
+            vec = coor[iat] - coor[jat]
+            d2 = numpy.sum(vec * vec, 1)
+            cut = rad[iat] + rad[jat] + tol
+            sel = (d2 < cut * cut) & (d2 > min_dist * min_dist)
+            bonds.append(numpy.array([iat[sel], jat[sel]]).T)
+
+        bonds = numpy.concatenate(bonds)
+        bonds = bonds[numpy.lexsort((bonds[:,1], bonds[:,0]))]
+
+        return bonds + 1
 
     def ret_partition(self,cutBonds=[], lvprt=1, inp_lists=[]):
         """
@@ -369,33 +455,47 @@ class structure:
         e.g. cutBonds=[(3,4),(7,8)]
         If inp_lists are specified, these are copied into at_lists as they are and only
         the remaining atoms are distributed.
+        The bonds are taken from ret_bonds() and the fragments are constructed as
+          connected components using union-find.
         """
-        at_lists = inp_lists
-        chk_list = []
-        remaining_atoms = [self.mol.NumAtoms()-i for i in range(self.mol.NumAtoms())]
+        at_lists = [list(inp_list) for inp_list in inp_lists]
+        num_at = self.ret_num_at()
 
+        assigned = numpy.zeros(num_at + 1, bool)
         for inp_list in inp_lists:
-            for iat in inp_list:
-                del remaining_atoms[remaining_atoms.index(iat)]
-
-        while(len(remaining_atoms)>0): # do the loop as long as there are still atoms which are not in at_lists
-            if len(chk_list) > 0:
-                curr_at = chk_list.pop()
-            else:
+            assigned[inp_list] = True
+        cut_set = set((min(bond), max(bond)) for bond in cutBonds)
+
+        # union-find with the lowest atom index as root
+        parent = list(range(num_at + 1))
+        def find(iat):
+            while parent[iat] != iat:
+                parent[iat] = parent[parent[iat]]
+                iat = parent[iat]
+            return iat
+
+        for iat, jat in self.ret_bonds().tolist():
+            if assigned[iat] or assigned[jat]:
+                continue
+            if (iat, jat) in cut_set:
+                print('cutting bond %i-%i'%(iat, jat))
+                continue
+            iroot = find(iat)
+            jroot = find(jat)
+            if iroot < jroot:
+                parent[jroot] = iroot
+            elif jroot < iroot:
+                parent[iroot] = jroot
+
+        frag_dict = {}
+        for iat in range(1, num_at + 1):
+            if assigned[iat]:
+                continue
+            root = find(iat)
+            if not root in frag_dict:
                 at_lists.append([])
-                curr_at = remaining_atoms.pop()
-                at_lists[-1].append(curr_at)
-
-            atom = self.mol.GetAtom(curr_at)
-            for bonded in openbabel.OBAtomAtomIter(atom):
-                bind = bonded.GetIdx()
-                if bind in remaining_atoms:
-                    if  (curr_at,bind) in cutBonds or (bind,curr_at) in cutBonds:
-                        print('cutting bond %i-%i'%(curr_at,bind))
-                    else:
-                        del remaining_atoms[remaining_atoms.index(bind)]
-                        chk_list.append(bind)
-                        at_lists[-1].append(bind)
+                frag_dict[root] = at_lists[-1]
+            frag_dict[root].append(iat)
 
         if lvprt >= 1:
             print("\n*** Fragment composition ***")
@@ -409,9 +509,7 @@ class structure:
         Return a partition according to the element types.
         """
         tmp_dict = {}
-        for i in range(self.mol.NumAtoms()):
-            atom = self.mol.GetAtom(i+1)
-            Z = atom.GetAtomicNum()
+        for i, Z in enumerate(self.ret_at_nums()):
             if not Z in tmp_dict:
                 tmp_dict[Z] = []
             tmp_dict[Z].append(i+1)
@@ -454,16 +552,9 @@ class structure:
         """
         Return a nuclear multipolemoment.
         """
-        mom = numpy.array([0., 0., 0.])
-
-        for i in range(self.mol.NumAtoms()):
-            atom = self.mol.GetAtom(i+1)
-            Z = atom.GetAtomicNum()
-            pos = numpy.array([atom.x(), atom.y(), atom.z()]) / units.length['A']
-
-            mom += Z * pos**power
+        pos = self.ret_coor() / units.length['A']
 
-        return mom
+        return numpy.dot(self.ret_at_nums(), pos**power)
 
     def make_coord_file(self, file_path, file_type=None, lvprt=0):
         """
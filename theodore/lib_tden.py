@@ -5,9 +5,10 @@ Analysis routines for transition density matrices.
 from __future__ import print_function, division
 
 from . import dens_ana_base, Om_descriptors, lib_mo, error_handler, pop_ana
-from . import orbkit_interface, fchk_parser
+from . import orbkit_interface, fchk_parser, lib_file
 import numpy
 import os
+import sys
 
 numpy.set_printoptions(precision=6, suppress=True)
 
@@ -78,19 +79,18 @@ class tden_ana(dens_ana_base.dens_ana_base):
         else:
             iterlist = self.state_list
 
-        omf = open(fname, 'w')
-
-        omf.write("%i\n"%len(self.ioptions['at_lists']))
+        names, Oms, OmFrags = [], [], []
         for state in iterlist:
             Om, OmFrag = self.ret_Om_OmFrag(state)
             if Om is None:
                 continue
-            omf.write("%10s %8.5f"%(state['name'], Om))
-            for el in OmFrag.flatten():
-                omf.write(" %8.5f"%el)
-            omf.write("\n")
+            names.append(state['name'])
+            Oms.append(Om)
+            OmFrags.append(OmFrag)
 
-        omf.close()
+        numF = len(self.ioptions['at_lists'])
+        lib_file.write_OmFrag(fname, names, Oms, numpy.reshape(OmFrags, (len(names), numF, numF)),
+                              binary=self.ioptions['output_bin'])
 #---
 
     def print_all_Om_descriptors(self, lvprt=2, desc_list=[]):
@@ -179,9 +179,8 @@ class tden_ana(dens_ana_base.dens_ana_base):
             eh_list.append("H_%i"%(ifrag+1))
             eh_list.append("E_%i"%(ifrag+1))
 
-        ostr = self.ret_summ_table(eh_list)
-
-        open(fname, 'w').write(ostr)
+        with open(fname, 'w') as f:
+            self.write_summ_table(f, eh_list)
         print("File %s with information about e/h populations written."%fname)
 
     def print_eh_At(self, state, lvprt=2):
@@ -196,7 +195,8 @@ class tden_ana(dens_ana_base.dens_ana_base):
         pop_pr.add_pop('sum', hpop+epop)
         pop_pr.add_pop('diff', hpop-epop)
 
-        print(pop_pr.ret_table())
+        pop_pr.write_table(sys.stdout)
+        print()
 
     def print_eh_Bas(self, state, lvprt=2):
         OmBas = state['OmBas']
@@ -210,7 +210,8 @@ class tden_ana(dens_ana_base.dens_ana_base):
         pop_pr.add_pop('sum', hpop+epop)
         pop_pr.add_pop('diff', hpop-epop)
 
-        print(pop_pr.ret_table())
+        pop_pr.write_table(sys.stdout)
+        print()
 
 #--------------------------------------------------------------------------#
 # Find data
@@ -395,7 +396,7 @@ class tden_ana(dens_ana_base.dens_ana_base):
         if jmol_orbs:
             jmolNTO = lib_mo.jmol_MOs("nto")
             jmolNTO.pre(ofile=self.ioptions.get('mo_file', strict=False))
-        cube_ids = []
+        jobs = []
         for state in self.state_list:
             (U, lam, Vt) = self.ret_NTO(state)
             if jmol_orbs:
@@ -405,34 +406,20 @@ class tden_ana(dens_ana_base.dens_ana_base):
                 self.export_NTOs_molden(state, U, lam, Vt, minlam=self.ioptions['min_occ'])
 
             if self.ioptions.get('cube_orbitals'):
-                lib_orbkit = orbkit_interface.lib_orbkit()
-                cbfid = lib_orbkit.cube_file_creator(state, U, lam, Vt, self.mos,minlam=self.ioptions['min_occ'],numproc=self.ioptions.get('numproc'))
-                cube_ids.append(cbfid)
+                jobs.append(self.ret_cube_job('NTOs %s'%state['name'], 'cube_file_creator',
+                                              state, U, lam, Vt, minlam=self.ioptions['min_occ']))
 
-        if self.ioptions.get('vmd_ntos'):
-            print("VMD network for NTOs")
-            lib_orbkit.vmd_network_creator(filename='NTOs',cube_ids=numpy.hstack(cube_ids),isovalue=self.ioptions.get('vmd_ntos_iv'))
+        if len(jobs) > 0:
+            lib_orbkit = self.ret_lib_orbkit()
+            cube_ids, failed = lib_orbkit.run_jobs(jobs, self.mos, numproc=self.ioptions['numproc'])
+
+            if self.ioptions.get('vmd_ntos'):
+                print("VMD network for NTOs")
+                lib_orbkit.vmd_network_creator(filename='NTOs',cube_ids=cube_ids,isovalue=self.ioptions.get('vmd_ntos_iv'))
 
         if jmol_orbs:
             jmolNTO.post()
 
-    def compute_p_h_dens(self):
-        """
-        Computation of electron/hole densities.
-        """
-        if len(self.state_list) == 0: return
-        if not 'tden' in self.state_list[0]: return
-
-        lib_orbkit = orbkit_interface.lib_orbkit()
-        cube_ids = []
-        for state in self.state_list:
-            (U, lam, Vt) = self.ret_NTO(state)
-            cbfid = lib_orbkit.compute_p_h_dens(state, U, lam, Vt, self.mos, minlam=self.ioptions['min_occ'],numproc=self.ioptions.get('numproc'))
-            cube_ids.append(cbfid)
-        if self.ioptions.get('vmd_ph_dens'):
-            print("VMD network for particle/hole densities")
-            lib_orbkit.vmd_network_creator(filename='p_h_dens',cube_ids=numpy.hstack(cube_ids),isovalue=self.ioptions.get('vmd_ph_dens_iv'))
-
     def compute_rho_0_n(self):
         """
         Computation of transition densities.
@@ -440,7 +427,7 @@ class tden_ana(dens_ana_base.dens_ana_base):
         if len(self.state_list) == 0: return
         if not 'tden' in self.state_list[0]: return
 
-        lib_orbkit = orbkit_interface.lib_orbkit()
+        lib_orbkit = self.ret_lib_orbkit()
         cube_ids = lib_orbkit.compute_rho_0_n(self.state_list,self.mos,numproc=self.ioptions.get('numproc'))
         if self.ioptions.get('vmd_rho0n'):
             print("VMD network for transition densities")
@@ -513,15 +500,26 @@ class tden_ana(dens_ana_base.dens_ana_base):
         if len(self.state_list) == 0: return
         if not 'tden' in self.state_list[0]: return
 
-        lib_orbkit = orbkit_interface.lib_orbkit()
-        cube_ids = []
+        jobs = []
         for state in self.state_list:
             (U, lam, Vt) = self.ret_NTO(state)
-            cbfid = lib_orbkit.compute_p_h_dens(state, U, lam, Vt, self.mos, minlam=self.ioptions['min_occ'],numproc=self.ioptions.get('numproc'))
-            cube_ids.append(cbfid)
+            jobs.append(self.ret_cube_job('p/h densities %s'%state['name'], 'compute_p_h_dens',
+                                          state, U, lam, Vt, minlam=self.ioptions['min_occ']))
+
+        lib_orbkit = self.ret_lib_orbkit()
+        cube_ids, failed = lib_orbkit.run_jobs(jobs, self.mos, numproc=self.ioptions['numproc'])
         if self.ioptions.get('vmd_ph_dens'):
             print("VMD network for particle/hole densities")
-            lib_orbkit.vmd_network_creator(filename='p_h_dens',cube_ids=numpy.hstack(cube_ids),isovalue=self.ioptions.get('vmd_ph_dens_iv'))
+            lib_orbkit.vmd_network_creator(filename='p_h_dens',cube_ids=cube_ids,isovalue=self.ioptions.get('vmd_ph_dens_iv'))
+
+    def ret_cube_job(self, label, meth, state, U, lam, Vt, **kwargs):
+        """
+        Return a job for lib_orbkit.run_jobs that writes the cube files for
+          a set of NTOs using the method <meth>.
+        Only the NTOs above minlam are kept to save memory when many jobs are queued.
+        """
+        nlam = numpy.sum(lam > kwargs['minlam'])
+        return (label, meth, (state, U[:, :nlam], lam[:nlam], Vt[:nlam], self.mos), kwargs)
 
     def compute_all_DNTO(self):
         """
@@ -542,9 +540,7 @@ class tden_ana(dens_ana_base.dens_ana_base):
             jme.pre(ofile=self.ioptions.get('mo_file', strict=False))
 
         dnto_dens = self.ioptions['comp_dnto_dens']
-        if dnto_dens > 0:
-            lib_orbkit = orbkit_interface.lib_orbkit()
-            cube_ids = []
+        jobs = []
 
         fchk_dens = self.ioptions['fchk_dnto_dens']
         if fchk_dens > 0:
@@ -579,12 +575,8 @@ class tden_ana(dens_ana_base.dens_ana_base):
                         print("Norm = %.2f < min_occ. Skipping %s ..."%(sum(lam), export_opts['post']))
                     else:
                         N = 1/sum(lam) if self.ioptions['normalize_dnto_dens'] else 1.
-                        try:
-                            cbfid = lib_orbkit.compute_p_h_dens(state, U, N * lam, Vt,
-                            self.mos, numproc=self.ioptions['numproc'], **export_opts)
-                            cube_ids.append(cbfid)
-                        except:
-                            print("... failed.")
+                        jobs.append(self.ret_cube_job('%s%s'%(state['name'], export_opts['post']),
+                                    'compute_p_h_dens', state, U, N * lam, Vt, **export_opts))
 
                 ### conditional electron density ###
                 (U, lam, Vt) = self.ret_DNTO_e(state, Aatoms, DNTO_denss)
@@ -601,17 +593,17 @@ class tden_ana(dens_ana_base.dens_ana_base):
                          print("Norm = %.2f < min_occ. Skipping %s ..."%(sum(lam), export_opts['post']))
                     else:
                         N = 1/sum(lam) if self.ioptions['normalize_dnto_dens'] else 1.
-                        try:
-                            cbfid = lib_orbkit.compute_p_h_dens(state, U, N * lam, Vt,
-                            self.mos, numproc=self.ioptions['numproc'], **export_opts)
-                            cube_ids.append(cbfid)
-                        except:
-                            print("... failed.")
+                        jobs.append(self.ret_cube_job('%s%s'%(state['name'], export_opts['post']),
+                                    'compute_p_h_dens', state, U, N * lam, Vt, **export_opts))
 
         if jmol_orbs:
             jmh.post()
             jme.post()
 
+        if len(jobs) > 0:
+            print("\nConditional densities as cube files ...")
+            cube_ids, failed = self.ret_lib_orbkit().run_jobs(jobs, self.mos, numproc=self.ioptions['numproc'])
+
     def ret_DNTO_h(self, state, Aatoms, DNTO_denss=None):
         # Compute an SVD for the density matrix with hole
         #   coordinates restricted to fragment A
@@ -663,7 +655,7 @@ class tden_ana(dens_ana_base.dens_ana_base):
         if len(self.state_list) == 0: return
         if not 'tden' in self.state_list[0]: return
 
-        lib_orbkit = orbkit_interface.lib_orbkit()
+        lib_orbkit = self.ret_lib_orbkit()
         cube_ids = lib_orbkit.compute_rho_0_n(self.state_list,self.mos,numproc=self.ioptions.get('numproc'))
         if self.ioptions.get('vmd_rho0n'):
             print("VMD network for transition densities")
@@ -672,13 +664,51 @@ class tden_ana(dens_ana_base.dens_ana_base):
 #---
 
     def analyze_excitons(self, exciton_ana):
+        """
+        Exciton sizes, binding energies, and e/h moments, evaluated for all states at once.
+        """
+        states = []
         for state in self.state_list:
             Om, OmAt = self.ret_Om_OmAt(state)
             if Om is None: continue
+            states.append(state)
+
+        if len(states) == 0: return
+
+        Oms   = numpy.array([state['Om'] for state in states])
+        OmAts = numpy.array([state['OmAt'] for state in states])
+        RMSeh, MAeh, Eb = exciton_ana.ret_descriptors(Oms, OmAts, self.ioptions['Eb_diag'])
+
+        eh_dict = exciton_ana.ret_eh_descriptors(Oms, OmAts)
+
+        for i, state in enumerate(states):
+            state['RMSeh'] = RMSeh[i]
+            state['MAeh']  = MAeh[i]
+            state['Eb']    = Eb[i]
+            for key, vals in eh_dict.items():
+                state[key] = vals[i]
+
+    def analyze_excitons_grid(self, exciton_ana):
+        """
+        Exact exciton descriptors from the 1TDM, using multipole integrals computed by
+          quadrature on the AO grid. All states are treated at once.
+        Values that were already parsed (e.g. from libwfa) are not overwritten.
+        """
+        states = [state for state in self.state_list if 'tden' in state]
+        if len(states) == 0: return
+
+        print("\nComputing exciton descriptors by grid quadrature ...")
+        moms = self.ret_lib_orbkit().ret_ao_moments(self.mos)
+
+        C = self.mos.ret_mo_mat()
+        Ds = numpy.array([numpy.dot(numpy.dot(C[:, :len(D)], D), C[:, :len(D[0])].T)
+                          for D in (state['tden'] for state in states)])
+        exc_dict = exciton_ana.ret_grid_descriptors(Ds, moms)
 
-            state['RMSeh'] = exciton_ana.ret_RMSeh(Om, OmAt)
-            state['MAeh']  = exciton_ana.ret_MAeh(Om, OmAt)
-            state['Eb']    = exciton_ana.ret_Eb(Om, OmAt, self.ioptions['Eb_diag'])
+        for i, state in enumerate(states):
+            for key, vals in exc_dict.items():
+                if not key in state:
+                    state[key] = vals[i]
 
 #---
 
@@ -2,108 +2,208 @@
 Library with some utilities that do not fit anywhere else.
 """
 
+import os
+import numpy
+
+# extension of compressed binary cube files
+binary_ext = '.cbz'
+
 class cube_file:
     """
     Analyse a cube file and compute isovalues corresponding to volume integrals.
+    The grid values are stored as a contiguous float64 array.
+    Files ending in .cbz are read and written in a compressed binary format
+      (numpy zip archive) that contains the cube header, the grid dimensions,
+      and the values as float32 or float64.
     """
-    def __init__(self, fname, header=None, vals=None, inc=None):
+    def __init__(self, fname, header=None, vals=None, inc=None, V=None):
         self.fname = fname
         self.header = header
-        self.vals =  vals
-        self.inc =   inc
+        self.vals = None if vals is None else numpy.asarray(vals, float)
+        self.inc = inc # number of values per row along z
+        self.V = V     # volume element
 
-        if self.vals is None:
-            self.avals = None
-        else:
-            self.avals = [abs(val) for val in self.vals]
+        self.avals = None
+
+    def is_binary(self):
+        return self.fname.endswith(binary_ext)
 
-    def read(self, lvprt=0):
+    def sidecar_name(self):
+        """
+        Name of the binary file used for memory-mapped reopening.
+        """
+        return self.fname + '.npy'
+
+    def read(self, lvprt=0, sidecar=False):
+        """
+        Read the cube file.
+        sidecar=True: store the values in a binary .npy file next to the cube file.
+           If this file exists and is up to date, the values are memory-mapped from it
+           rather than parsed.
+        """
         if lvprt >= 1:
             print('Analysing %s ...'%self.fname)
-        with open(self.fname, 'r') as f:
-            line = next(f)
-            line = next(f)
-            line = next(f)
-            natom = int(line.split()[0])
-            words = next(f).split()
-            x = float(words[1])
-            words = next(f).split()
-            y = float(words[2])
-            words = next(f).split()
-            self.inc = int(words[0])
-            z = float(words[3])
-            self.V = x * y * z
-            for iat in range(natom):
-                line = next(f)
-
-            self.vals = []
-            while True: # loop over all lines
-                try:
-                    line = next(f)
-                except StopIteration:
-                    if lvprt >= 1:
-                        print("Reached end of file %s"%f.name)
-                    break
-
-                self.vals += map(float, line.split())
-
-        # save the header separately
-        self.header = ''
-        with open(self.fname, 'r') as f:
-            for i in range(natom + 6):
-                self.header += next(f)
-
-        self.s = sum(self.vals)
-        self.avals = [abs(val) for val in self.vals]
-        self.abss = sum(self.avals)
-        self.sqs = sum(val*val for val in self.vals)
-        self.minval = min(self.vals)
-        self.maxval = max(self.vals)
+
+        if self.is_binary():
+            self.read_binary()
+        else:
+            self.read_text(lvprt, sidecar)
+
+        self.s = numpy.sum(self.vals)
+        self.abss = numpy.sum(numpy.abs(self.vals))
+        self.sqs = numpy.dot(self.vals, self.vals)
+        self.minval = numpy.min(self.vals)
+        self.maxval = numpy.max(self.vals)
         if lvprt >= 1:
             print('Integral: % .6f, Abs. Int.: % .6f, Squ. Int. % .6f:'%(self.s * self.V, self.abss * self.V, self.sqs * self.V))
             print('Min: % .6f, Max % .6f'%(self.minval, self.maxval))
-        self.avals.sort(reverse=True)
+        self.avals = None
 
-    def write(self):
+    def read_text(self, lvprt=0, sidecar=False):
+        """
+        Read the header and the values of a text cube file.
+        """
+        sname = self.sidecar_name()
+        use_sidecar = sidecar and os.path.exists(sname) and \
+            os.path.getmtime(sname) >= os.path.getmtime(self.fname)
+
+        with open(self.fname, 'r') as f:
+            self.read_header(f)
+            if use_sidecar:
+                if lvprt >= 1:
+                    print("Reading values from %s"%sname)
+                self.vals = numpy.load(sname, mmap_mode='r')
+            else:
+                self.vals = numpy.fromstring(f.read(), dtype=float, sep=' ')
+                if lvprt >= 1:
+                    print("Reached end of file %s"%f.name)
+
+        if sidecar and not use_sidecar:
+            numpy.save(sname, self.vals)
+            if lvprt >= 1:
+                print("Values written to %s"%sname)
+
+    def read_binary(self):
+        """
+        Read a compressed binary cube file.
+        """
+        with numpy.load(self.fname) as data:
+            self.header = str(data['header'])
+            self.N = [int(n) for n in data['N']]
+            self.V = float(data['V'])
+            self.vals = numpy.asarray(data['vals'], float)
+        self.inc = self.N[2]
+
+    def read_header(self, f):
+        """
+        Read the header from an open file and store it separately.
+        """
+        lines = [next(f) for i in range(3)]
+        natom = int(lines[2].split()[0])
+        for i in range(3):
+            lines.append(next(f))
+        self.N = [int(line.split()[0]) for line in lines[3:6]]
+        self.inc = self.N[2]
+        self.V = float(lines[3].split()[1]) * float(lines[4].split()[2]) * float(lines[5].split()[3])
+
+        for iat in range(abs(natom)):
+            lines.append(next(f))
+        if natom < 0:
+            # line with the MO indices
+            lines.append(next(f))
+
+        self.header = ''.join(lines)
+
+    def write(self, block=4096, dtype='float32'):
         """
         Write cube file to fname.
+        The values are formatted in blocks of rows, keeping the layout of
+          six values per line with a line break after every row of inc values.
+        Binary files are written with values of type dtype.
         """
+        if self.is_binary():
+            self.write_binary(dtype)
+            return
+
+        nval = len(self.vals)
+        nrow = 0 if self.inc is None else nval // self.inc
+        ncol = 0 if self.inc is None else self.inc
+
+        row_fmt = ("% 14.6e" * 6 + "\n") * (ncol // 6)
+        if ncol % 6 > 0:
+            row_fmt += "% 14.6e" * (ncol % 6) + "\n"
+
         with open(self.fname, 'w') as f:
             f.write(self.header)
-            i = 0
-            for val in self.vals:
-                f.write("% 14.6e"%val)
-                i += 1
-                if i==self.inc:
-                    f.write('\n')
-                    i = 0
-                elif i%6 == 0:
-                    f.write('\n')
+            for ist in range(0, nrow, block):
+                ien = min(ist + block, nrow)
+                f.write(row_fmt * (ien - ist) % tuple(self.vals[ist*ncol:ien*ncol]))
+
+            # remaining values that do not form a complete row
+            tail = self.vals[nrow*ncol:]
+            ntail = len(tail)
+            tail_fmt = ("% 14.6e" * 6 + "\n") * (ntail // 6) + "% 14.6e" * (ntail % 6)
+            f.write(tail_fmt % tuple(tail))
+
+    def write_binary(self, dtype='float32'):
+        """
+        Write a compressed binary cube file.
+        """
+        # grid dimensions and volume element from the header
+        self.read_header(iter(self.header.splitlines(True)))
+        with open(self.fname, 'wb') as f:
+            numpy.savez_compressed(f, header=numpy.array(self.header), N=numpy.array(self.N),
+                                   V=numpy.array(self.V), vals=numpy.asarray(self.vals, dtype))
+
+    def ret_avals(self, thres=None, nbin=256):
+        """
+        Return the absolute values sorted in descending order.
+        If thres is given, only the largest values whose sum exceeds thres are
+          returned. They are preselected with a histogram so that only a small
+          part of the grid has to be sorted.
+        """
+        avals = numpy.abs(self.vals)
+        if not thres is None and 0. < thres < self.abss:
+            amax = numpy.max(avals)
+            amin = numpy.min(avals[avals > 0.])
+            if amin < amax:
+                edges = numpy.geomspace(amin, amax, nbin + 1)
+                sums, edges = numpy.histogram(avals, bins=edges, weights=avals)
+                # number of bins, counted from the top, needed to exceed thres
+                #   plus one bin as safety margin for rounding
+                ntop = numpy.searchsorted(numpy.cumsum(sums[::-1]), thres, side='right') + 2
+                if ntop <= nbin:
+                    sel = avals[avals >= edges[nbin - ntop]]
+                    if numpy.sum(sel) > thres:
+                        avals = sel
+
+        self.avals = numpy.sort(avals)[::-1]
+        return self.avals
 
     def ret_isovals(self, frac=[0.1, 0.5, 0.75, 0.9, 0.95, 0.99], lvprt=0):
         """
         Return the isovalues that correspond to a specific fraction of the density.
+        The isovalue for a fraction is the first value, in descending order, at which
+          the cumulative sum exceeds this fraction of the absolute integral.
         """
         if self.vals is None:
             self.read(lvprt)
 
-        retvals = []
+        frac = sorted(frac)
+        thres = numpy.array(frac) * self.abss
+        avals = self.ret_avals(thres[-1])
+        psum = numpy.cumsum(avals)
 
-        frac.sort()
-        ifrac = 0
-        ps = 0.
-        thres = frac[ifrac] * self.abss
-        for val in self.avals:
-            ps += val
-            if ps > thres:
-                retvals.append(val)
-                if lvprt >= 1:
-                    print("isoval: %.6f at %.4f (%.6f)"%(val, frac[ifrac], ps/self.abss))
-                ifrac += 1
-                try:
-                    thres = frac[ifrac] * self.abss
-                except IndexError:
-                    break
+        retvals = []
+        ind = -1
+        for ifrac, thr in enumerate(thres):
+            # each fraction takes a new value, as in a sequential walk
+            ind = max(numpy.searchsorted(psum, thr, side='right'), ind + 1)
+            if ind >= len(avals):
+                break
+            retvals.append(avals[ind])
+            if lvprt >= 1:
+                print("isoval: %.6f at %.4f (%.6f)"%(avals[ind], frac[ifrac], psum[ind]/self.abss))
 
         return retvals
 
@@ -116,6 +216,7 @@ class cube_file:
         if other.vals is None:
             other.read(lvprt=lvprt)
         assert self.V == other.V
+        assert len(self.vals) == len(other.vals)
 
     def dot(self, other, lvprt=0):
         """
@@ -123,7 +224,7 @@ class cube_file:
         """
         self.prep(other, lvprt)
 
-        dot = sum(val * other.vals[ival] for ival, val in enumerate(self.vals)) * self.V
+        dot = numpy.dot(self.vals, other.vals) * self.V
         if lvprt >= 1:
             print("Computing dot product between %s and %s"%(self.fname, other.fname))
             print("Dot: % .6f"%dot)
@@ -136,9 +237,9 @@ class cube_file:
         """
         self.prep(other, lvprt)
 
-        lc = [c * val + d * other.vals[ival] for ival, val in enumerate(self.vals)]
+        lc = c * self.vals + d * other.vals
 
-        return cube_file(outfile, self.header, lc, self.inc)
+        return cube_file(outfile, self.header, lc, self.inc, self.V)
 
     def mult(self, other, outfile, lvprt=0):
         """
@@ -147,6 +248,110 @@ class cube_file:
         """
         self.prep(other, lvprt)
 
-        prod = [val * other.vals[ival] for ival, val in enumerate(self.vals)]
+        prod = self.vals * other.vals
+
+        return cube_file(outfile, self.header, prod, self.inc, self.V)
+
+def convert_cube(fname, outname=None, dtype='float32', lvprt=0):
+    """
+    Convert between text and binary cube files.
+    By default, the extension is switched between .cb and .cbz.
+    Returns the name of the file written.
+    """
+    cube = cube_file(fname)
+    if outname is None:
+        base = os.path.splitext(fname)[0]
+        outname = base + ('.cb' if cube.is_binary() else binary_ext)
+
+    cube.read(lvprt)
+    cube.fname = outname
+    cube.write(dtype=dtype)
+    if lvprt >= 1:
+        print("File %s written."%outname)
+
+    return outname
+
+def ret_text_cube(fname, lvprt=0):
+    """
+    Return the name of a text version of a cube file, which can be read by external viewers.
+    Binary files are converted unless an up-to-date text file exists.
+    """
+    cube = cube_file(fname)
+    if not cube.is_binary():
+        return fname
+
+    outname = os.path.splitext(fname)[0] + '.cb'
+    if os.path.exists(outname) and os.path.getmtime(outname) >= os.path.getmtime(fname):
+        return outname
+    return convert_cube(fname, outname, lvprt=lvprt)
+
+def ret_isovals_list(fnames, frac=[0.1, 0.5, 0.75, 0.9, 0.95, 0.99], numproc=1, lvprt=0):
+    """
+    Return the isovalues for a list of cube files.
+    For numproc > 1 the files are processed in parallel.
+    """
+    args = [(fname, frac, lvprt) for fname in fnames]
+    if numproc > 1 and len(fnames) > 1:
+        from multiprocessing import Pool
+        with Pool(numproc) as pool:
+            return pool.map(_cube_isovals, args, chunksize=1)
+    else:
+        return [_cube_isovals(arg) for arg in args]
+
+def _cube_isovals(args):
+    fname, frac, lvprt = args
+    return cube_file(fname).ret_isovals(frac, lvprt)
+
+def ret_assignment(cost):
+    """
+    Solve the linear assignment problem for a (nrow, ncol) cost matrix
+      with the Hungarian algorithm (O(n^3), using row and column potentials).
+    Returns the column assigned to every row such that the total cost is minimal.
+    If there are more rows than columns, the unassigned rows get -1.
+    """
+    cost = numpy.asarray(cost, dtype=float)
+    nrow, ncol = cost.shape
+    if nrow > ncol:
+        rows = -numpy.ones(nrow, dtype=int)
+        rows[ret_assignment(cost.T)] = numpy.arange(ncol)
+        return rows
+
+    # indices are shifted by one, column 0 is a dummy column
+    u = numpy.zeros(nrow + 1)
+    v = numpy.zeros(ncol + 1)
+    p = numpy.zeros(ncol + 1, dtype=int)   # row assigned to each column
+    way = numpy.zeros(ncol + 1, dtype=int) # previous column on the augmenting path
+    for i in range(1, nrow + 1):
+        p[0] = i
+        j0 = 0
+        minv = numpy.full(ncol + 1, numpy.inf)
+        used = numpy.zeros(ncol + 1, dtype=bool)
+        while True:
+            used[j0] = True
+            i0 = p[j0]
+            free = ~used
+            free[0] = False
+            cur = cost[i0-1] - u[i0] - v[1:]
+            upd = free[1:] & (cur < minv[1:])
+            minv[1:][upd] = cur[upd]
+            way[1:][upd] = j0
+
+            mfree = numpy.where(free, minv, numpy.inf)
+            j1 = numpy.argmin(mfree)
+            delta = mfree[j1]
+
+            u[p[used]] += delta
+            v[used] -= delta
+            minv[free] -= delta
+            j0 = j1
+            if p[j0] == 0: break
+
+        # augment along the path
+        while j0 != 0:
+            j1 = way[j0]
+            p[j0] = p[j1]
+            j0 = j1
 
-        return cube_file(outfile, self.header, prod, self.inc)
\ No newline at end of file
+    rows = -numpy.ones(nrow, dtype=int)
+    rows[p[1:][p[1:] > 0] - 1] = numpy.nonzero(p[1:] > 0)[0]
+    return rows
@@ -7,6 +7,7 @@ from __future__ import print_function, division
 
 from . import error_handler, lib_struc
 import numpy
+import sys
 
 class pop_ana:
     """
@@ -67,9 +68,7 @@ class pop_printer:
         self.pops.append(pop)
 
     def header(self, inp):
-        hstr = inp
-        for pop_type in self.pop_types:
-            hstr += '%10s'%pop_type
+        hstr = inp + ''.join('%10s'%pop_type for pop_type in self.pop_types)
 
         retstr  = len(hstr) * '-' + "\n"
         retstr += hstr
@@ -77,38 +76,56 @@ class pop_printer:
 
         return hstr, retstr
 
-    def ret_table(self, labels=[]):
+    def ret_lines(self, head, row_labels, sum_label, sums):
         """
-        Return a table containing all the populations of interest.
+        Return the lines of a table with one row per label, followed by the sums.
+        The populations in every row are formatted with one format string.
         """
-        if len(self.pop_types) == 0:
-            return "  ... no population analysis data available."
+        hstr, retstr = self.header(head)
+        vfmt = '% 10.5f' * len(self.pops)
+        nrow = len(row_labels)
+        vals = numpy.column_stack([pop[:nrow] for pop in self.pops]).tolist()
 
-        hstr, retstr = self.header('%6s'%'Atom')
+        lines = [retstr]
+        lines += [label + vfmt%tuple(row) + '\n' for label, row in zip(row_labels, vals)]
 
-        # main part
-        for iat in range(len(self.pops[0])):
-            if labels != []:
-                retstr += '%6s'%labels[iat]
-            elif self.struc is None:
-                retstr += '%6i'%(iat+1)
-            else:
-                retstr += '%3s%3i'%(self.struc.ret_symbol(iat+1), iat+1)
+        # sums
+        sep = len(hstr) * '-' + "\n"
+        lines += [sep, sum_label + vfmt%tuple(sums) + "\n", sep]
 
-            for pop in self.pops:
-                retstr += '% 10.5f'%pop[iat]
-            retstr += '\n'
+        return lines
 
-        # sums
-        retstr += len(hstr) * '-' + "\n"
+    def ret_table(self, labels=[]):
+        """
+        Return a table containing all the populations of interest.
+        """
+        return ''.join(self.ret_table_lines(labels))
+
+    def write_table(self, f, labels=[]):
+        """
+        Write the table of ret_table to the open file f.
+        """
+        f.writelines(self.ret_table_lines(labels))
 
-        retstr += '%6s'%''
-        for pop in self.pops:
-            retstr += '% 10.5f'%pop.sum()
+    def ret_table_lines(self, labels=[]):
+        if len(self.pop_types) == 0:
+            return ["  ... no population analysis data available."]
 
-        retstr += "\n" + len(hstr) * '-' + "\n"
+        nat = len(self.pops[0])
+        if labels != []:
+            row_labels = ['%6s'%labels[iat] for iat in range(nat)]
+        elif self.struc is None:
+            row_labels = ['%6i'%(iat+1) for iat in range(nat)]
+        else:
+            row_labels = ['%3s%3i'%(self.struc.ret_symbol(iat+1), iat+1) for iat in range(nat)]
 
-        return retstr
+        return self.ret_lines('%6s'%'Atom', row_labels, '%6s'%'', [pop.sum() for pop in self.pops])
+
+    def ret_frag_labels(self, at_lists):
+        if self.struc is None:
+            return ['%15i'%(i+1) for i in range(len(self.pops[0]))]
+        else:
+            return ['%15s'%(self.struc.ret_at_list_composition(at_lists[i])) for i in range(len(self.pops[0]))]
 
     def ret_table_Frag(self, at_lists):
         """
@@ -117,55 +134,15 @@ class pop_printer:
         if len(self.pop_types) == 0:
             return "  ... no population analysis data available."
 
-        hstr, retstr = self.header('%15s'%'Fragment')
-
-        # main part
-        for i in range(len(self.pops[0])):
-            if self.struc is None:
-                retstr += '%15i'%(i+1)
-            else:
-                retstr += '%15s'%(self.struc.ret_at_list_composition(at_lists[i]))
-            for pop in self.pops:
-                retstr += '% 10.5f'%pop[i]
-            retstr += '\n'
-
-        # sums
-        retstr += len(hstr) * '-' + "\n"
-
-        retstr += '%15s'%''
-        for pop in self.pops:
-            retstr += '% 10.5f'%pop.sum()
-
-        retstr += "\n" + len(hstr) * '-' + "\n"
-
-        return retstr
+        return ''.join(self.ret_lines('%15s'%'Fragment', self.ret_frag_labels(at_lists), '%15s'%'',
+                                      [pop.sum() for pop in self.pops]))
 
     def ret_table_FCD(self, at_lists):
         """
         Table for FCD.
         """
-        hstr, retstr = self.header('%15s'%'Fragment')
-
-        # main part
-        for i in range(len(self.pops[0])):
-            if self.struc is None:
-                retstr += '%15i'%(i+1)
-            else:
-                retstr += '%15s'%(self.struc.ret_at_list_composition(at_lists[i]))
-            for pop in self.pops:
-                retstr += '% 10.5f'%pop[i]
-            retstr += '\n'
-
-        # sums
-        retstr += len(hstr) * '-' + "\n"
-
-        retstr += '%15s'%'FCD'
-        for pop in self.pops:
-            retstr += '% 10.5f'%(pop[1]-pop[0])
-
-        retstr += "\n" + len(hstr) * '-' + "\n"
-
-        return retstr
+        return ''.join(self.ret_lines('%15s'%'Fragment', self.ret_frag_labels(at_lists), '%15s'%'FCD',
+                                      [pop[1]-pop[0] for pop in self.pops]))
 
 class pop_printer_mo(pop_printer):
     """
@@ -189,8 +166,10 @@ class pop_printer_mo(pop_printer):
             self.add_pop('MO %i'%(imo+1), mp)
 
             if (imo+1) % ncol == 0:
-                print(self.ret_table(labels))
+                self.write_table(sys.stdout, labels)
+                print()
                 self.clear()
 
         if (imo+1) % ncol != 0:
-            print(self.ret_table(labels))
+            self.write_table(sys.stdout, labels)
+            print()
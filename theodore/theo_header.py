@@ -140,6 +140,9 @@ def add_orbkit(ioptions):
     except TypeError:
         return ''
 
+    from . import orbkit_interface
+    ok_use = ok_use and orbkit_interface.orbkit_avail
+
     rstr = ''
     if ok_use:
         rstr += addlinec()